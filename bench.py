@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import event
+
+import mock
+from server import app, models, resources
+
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench'
+
+class QueryCounter:
+    """Counts the SQL statements executed by the current thread."""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+class InProcessClient:
+    def __init__(self, counter):
+        self.client = app.test_client()
+        self.counter = counter
+
+    def request(self, method, path, body=None, token=None):
+        headers = {}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        self.counter.reset()
+        response = self.client.open('/v1' + path, method=method,
+                                    json=body, headers=headers)
+        response.get_data()
+        return response.status_code, response.get_json(silent=True), \
+            self.counter.count
+
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, body=None, token=None):
+        data = None
+        request = urllib.request.Request(self.url + '/v1' + path,
+                                         method=method)
+        if body is not None:
+            data = json.dumps(body).encode()
+            request.add_header('Content-Type', 'application/json')
+        if token:
+            request.add_header('Authorization', 'Bearer ' + token)
+        try:
+            with urllib.request.urlopen(request, data) as response:
+                content = response.read()
+                status = response.status
+                query_count = query_count_from(response.headers)
+        except urllib.error.HTTPError as e:
+            return e.code, None, query_count_from(e.headers)
+        try:
+            return status, json.loads(content.decode()), query_count
+        except ValueError:
+            return status, None, query_count
+
+def query_count_from(headers):
+    """Reads the db query count from a Server-Timing header, if present."""
+    for metric in (headers.get('Server-Timing') or '').split(','):
+        name, _, params = metric.strip().partition(';')
+        if name != 'db':
+            continue
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'desc' and value.strip('"').endswith(' queries'):
+                return int(value.strip('"').split()[0])
+    return None
+
+def seed(scale, seed_value):
+    user = models.User.query.filter_by(username=BENCH_USER).first()
+    if not user:
+        user = models.User()
+        user.username = BENCH_USER
+        user.full_name = 'Benchmark User'
+        user.email = 'bench@example.com'
+        user.hash_password(BENCH_PASSWORD)
+        models.db.session.add(user)
+        models.db.session.commit()
+
+    mock.Config.SEED = seed_value
+    mock.Config.SUPERUSER = BENCH_USER
+    mock.Config.USER_COUNT = 100 * scale
+    mock.Config.PROJECT_COUNT = 10 * scale
+    mock.Config.SPRINT_COUNT = 50 * scale
+    mock.Config.TASK_COUNT = 500 * scale
+    mock.Config.COMMENT_COUNT = 1000 * scale
+    mock.FastMocker().mock()
+
+    models.membership_cache.clear()
+    if resources.response_cache is not None:
+        resources.response_cache.clear()
+    models.db.session.remove()
+
+    return {
+        'users': mock.Config.USER_COUNT,
+        'projects': mock.Config.PROJECT_COUNT,
+        'sprints': mock.Config.SPRINT_COUNT,
+        'tasks': mock.Config.TASK_COUNT,
+        'comments': mock.Config.COMMENT_COUNT
+    }
+
+def sample_ids():
+    user = models.User.query.filter_by(username=BENCH_USER).first()
+    project_ids = [x.id for x in user.projects]
+    samples = {
+        'project_alias': [x.alias for x in user.projects],
+        'sprint_id': [x for x, in models.db.session
+                      .query(models.Sprint.id)
+                      .filter(models.Sprint.project_id.in_(project_ids))
+                      .limit(1000)],
+        'task_id': [x for x, in models.db.session
+                    .query(models.Task.id)
+                    .filter(models.Task.project_id.in_(project_ids))
+                    .limit(1000)],
+        'comment_id': [x for x, in models.db.session
+                       .query(models.Comment.id)
+                       .join(models.Task)
+                       .filter(models.Task.project_id.in_(project_ids))
+                       .limit(1000)],
+        'words': [x.split()[0] for x, in models.db.session
+                  .query(models.Task.title)
+                  .filter(models.Task.project_id.in_(project_ids))
+                  .limit(100)]
+    }
+    models.db.session.remove()
+    return samples
+
+# Request bodies for endpoints that are not plain GETs. Writes are chosen so
+# that they can be repeated without exhausting the data set.
+def login_request(rng, args):
+    return 'POST', {'username': BENCH_USER, 'password': BENCH_PASSWORD}
+
+def task_comments_request(rng, args):
+    if rng.random() < 0.9:
+        return 'GET', None
+    return 'POST', {'message': 'Benchmark comment'}
+
+def tasks_request(rng, args):
+    return 'PATCH', [{'id': x, 'priority': rng.randrange(-2, 2)}
+                     for x in rng.sample(args['task_ids'],
+                                         min(10, len(args['task_ids'])))]
+
+def project_tasks_bulk_request(rng, args):
+    return 'POST', [{'title': 'Benchmark task', 'kind': 'FEATURE'}
+                    for i in range(10)]
+
+def project_search_request(rng, args):
+    return 'GET', None, {'q': rng.choice(args['words']), 'limit': 20}
+
+REQUESTS = {
+    'login': login_request,
+    'taskcomments': task_comments_request,
+    'tasks': tasks_request,
+    'projecttasksbulk': project_tasks_bulk_request,
+    'projectsearch': project_search_request
+}
+
+def routes():
+    """Yields (endpoint, rule) for every route registered on the API."""
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/v1/'):
+            yield rule.endpoint, rule
+
+def build_path(adapter, endpoint, rule, rng, samples):
+    values = {}
+    for name in rule.arguments:
+        if not samples.get(name):
+            return None
+        values[name] = rng.choice(samples[name])
+    return adapter.build(endpoint, values)[len('/v1'):]
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1,
+                      int(round(p / 100 * (len(values) - 1))))]
+
+def run_endpoint(make_client, endpoint, rule, token, samples, args):
+    rng = random.Random('{}-{}'.format(args.seed, endpoint))
+    adapter = app.url_map.bind('localhost')
+    jobs = []
+    for i in range(args.requests):
+        path = build_path(adapter, endpoint, rule, rng, samples)
+        if path is None:
+            return None
+        method, body, params = 'GET', None, None
+        if endpoint in REQUESTS:
+            method, body, *params = REQUESTS[endpoint](rng, {
+                'task_ids': samples['task_id'],
+                'words': samples['words']
+            })
+            params = params[0] if params else None
+        elif 'GET' not in rule.methods:
+            return None
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        jobs.append((method, path, body))
+
+    latencies = []
+    query_counts = []
+    errors = []
+    lock = threading.Lock()
+    job_iter = iter(jobs)
+
+    def worker():
+        client = make_client()
+        while True:
+            with lock:
+                job = next(job_iter, None)
+            if job is None:
+                return
+            method, path, body = job
+            started = time.perf_counter()
+            status, _, query_count = client.request(method, path, body, token)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+                if query_count is not None:
+                    query_counts.append(query_count)
+                if status >= 400:
+                    errors.append(status)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    return {
+        'rule': rule.rule,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / wall_time,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'queries': (sum(query_counts) / len(query_counts)
+                    if query_counts else None)
+    }
+
+def poll(url, path, token, interval, deadline, rng, record):
+    """Repeats a conditional GET of path every interval seconds."""
+    etag = None
+    time.sleep(rng.random() * interval)
+    while time.perf_counter() < deadline:
+        request = urllib.request.Request(url + '/v1' + path)
+        request.add_header('Authorization', 'Bearer ' + token)
+        if etag:
+            request.add_header('If-None-Match', etag)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                status = response.status
+                etag = response.headers.get('ETag') or etag
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError:
+            status = None
+        elapsed = time.perf_counter() - started
+        record(status, elapsed)
+        time.sleep(max(0, interval - elapsed))
+
+def run_pollers(token, samples, args):
+    """Keeps args.pollers clients polling a project, as dashboards do.
+
+    With SQL_SIMULATED_LATENCY set on the server, every poll holds its
+    handler for that long while using almost no CPU, which is where
+    cooperative servers should differ from thread-per-request ones.
+    """
+    rng = random.Random(args.seed)
+    adapter = app.url_map.bind('localhost')
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+
+    def record(status, elapsed):
+        with lock:
+            statuses.append(status)
+            latencies.append(elapsed * 1000)
+
+    started = time.perf_counter()
+    deadline = started + args.duration
+    threads = []
+    for i in range(args.pollers):
+        path = adapter.build('project', {
+            'project_alias': rng.choice(samples['project_alias'])
+        })[len('/v1'):]
+        threads.append(threading.Thread(
+            target=poll, daemon=True,
+            args=(args.url.rstrip('/'), path, token, args.poll_interval,
+                  deadline, random.Random(rng.random()), record)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    return {
+        'pollers': args.pollers,
+        'interval': args.poll_interval,
+        'requests': len(latencies),
+        'throughput': len(latencies) / wall_time,
+        'target_throughput': args.pollers / args.poll_interval,
+        'not_modified': statuses.count(304),
+        'errors': sum(1 for x in statuses if x not in (200, 304)),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+def print_poll_results(scale, x):
+    print('[*] Scale {}: {} pollers every {} s'.format(
+        scale, x['pollers'], x['interval']))
+    print('    {:>9} {:>9} {:>8} {:>8} {:>8} {:>7} {:>7}'.format(
+        'req/s', 'target', 'p50 ms', 'p95 ms', 'p99 ms', '304s', 'errors'))
+    print('    {:>9.1f} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>7} {:>7}'.format(
+        x['throughput'], x['target_throughput'], x['p50'], x['p95'],
+        x['p99'], x['not_modified'], x['errors']))
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL)\
+            .decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(scale, results):
+    print('[*] Scale {}'.format(scale))
+    print('    {:<22} {:>9} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries',
+        'errors'))
+    for endpoint, x in sorted(results.items()):
+        print('    {:<22} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8} {:>7}'.format(
+            endpoint, x['throughput'], x['p50'], x['p95'], x['p99'],
+            '-' if x['queries'] is None else '{:.1f}'.format(x['queries']),
+            x['errors']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the v1 API.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                        help='multiples of the default mock.py sizes')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=mock.Config.SEED)
+    parser.add_argument('--endpoint', action='append',
+                        help='only run the given endpoints')
+    parser.add_argument('--url',
+                        help='drive a running server instead of the app '
+                             'in this process')
+    parser.add_argument('--pollers', type=int,
+                        help='instead of the endpoints, keep this many '
+                             'clients polling with conditional GETs; '
+                             'requires --url')
+    parser.add_argument('--poll-interval', type=float, default=1,
+                        help='seconds between the polls of a client')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds to poll for')
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+    if args.pollers and not args.url:
+        parser.error('--pollers requires --url')
+
+    if args.url:
+        make_client = lambda: HttpClient(args.url)
+    else:
+        counter = QueryCounter(models.db.engine)
+        make_client = lambda: InProcessClient(counter)
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(),
+        'url': args.url,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'scales': []
+    }
+    for scale in args.scales:
+        sizes = seed(scale, args.seed)
+        samples = sample_ids()
+        status, body, _ = make_client().request(
+            'POST', '/login', {'username': BENCH_USER,
+                               'password': BENCH_PASSWORD})
+        if status != 200:
+            raise SystemExit('Cannot log in as {}'.format(BENCH_USER))
+        token = body['access_token']
+
+        if args.pollers:
+            result = run_pollers(token, samples, args)
+            print_poll_results(scale, result)
+            report['scales'].append({
+                'scale': scale,
+                'sizes': sizes,
+                'pollers': result
+            })
+            continue
+
+        results = {}
+        for endpoint, rule in routes():
+            if args.endpoint and endpoint not in args.endpoint:
+                continue
+            result = run_endpoint(make_client, endpoint, rule, token,
+                                  samples, args)
+            if result:
+                results[endpoint] = result
+        print_results(scale, results)
+        report['scales'].append({
+            'scale': scale,
+            'sizes': sizes,
+            'endpoints': results
+        })
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('[*] Saved {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
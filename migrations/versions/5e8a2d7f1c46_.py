@@ -0,0 +1,38 @@
+"""empty message
+
+Revision ID: 5e8a2d7f1c46
+Revises: c41d7a5e9b13
+Create Date: 2026-10-18 21:12:44.018356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8a2d7f1c46'
+down_revision = 'c41d7a5e9b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE tasks ADD COLUMN search_vector tsvector "
+               "GENERATED ALWAYS AS ("
+               "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+               "setweight(to_tsvector('simple', coalesce(user_story, '')), 'B') || "
+               "setweight(to_tsvector('simple', coalesce(acceptance_criteria, '')), 'B')"
+               ") STORED")
+    op.execute("ALTER TABLE comments ADD COLUMN search_vector tsvector "
+               "GENERATED ALWAYS AS ("
+               "setweight(to_tsvector('simple', coalesce(message, '')), 'A')"
+               ") STORED")
+    op.create_index('ix_tasks_search_vector', 'tasks', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_comments_search_vector', 'comments', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_comments_search_vector', table_name='comments')
+    op.drop_index('ix_tasks_search_vector', table_name='tasks')
+    op.drop_column('comments', 'search_vector')
+    op.drop_column('tasks', 'search_vector')
@@ -0,0 +1,26 @@
+"""empty message
+
+Revision ID: 9d3c6b1a7e52
+Revises: 5e8a2d7f1c46
+Create Date: 2026-10-18 21:47:19.530612
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c6b1a7e52'
+down_revision = '5e8a2d7f1c46'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_tasks_project_id_creation_date_id', 'tasks', ['project_id', 'creation_date', 'id'], unique=False)
+    op.create_index('ix_tasks_sprint_id_creation_date_id', 'tasks', ['sprint_id', 'creation_date', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tasks_sprint_id_creation_date_id', table_name='tasks')
+    op.drop_index('ix_tasks_project_id_creation_date_id', table_name='tasks')
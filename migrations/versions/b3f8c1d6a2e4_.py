@@ -0,0 +1,26 @@
+"""empty message
+
+Revision ID: b3f8c1d6a2e4
+Revises: e7b4f0c2a981
+Create Date: 2026-10-19 11:42:07.513962
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f8c1d6a2e4'
+down_revision = 'e7b4f0c2a981'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_tasks_author_id', 'tasks', ['author_id'], unique=False)
+    op.create_index('ix_comments_author_id', 'comments', ['author_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_author_id', table_name='comments')
+    op.drop_index('ix_tasks_author_id', table_name='tasks')
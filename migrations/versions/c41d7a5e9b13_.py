@@ -0,0 +1,42 @@
+"""empty message
+
+Revision ID: c41d7a5e9b13
+Revises: 8f1b2e6c4d90
+Create Date: 2026-10-18 20:31:07.552918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7a5e9b13'
+down_revision = '8f1b2e6c4d90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Duplicate memberships would break the unique index below
+    op.execute('DELETE FROM project_members a USING project_members b '
+               'WHERE a.ctid < b.ctid '
+               'AND a.project_id = b.project_id AND a.user_id = b.user_id')
+    op.create_index('ix_project_members_project_id_user_id', 'project_members', ['project_id', 'user_id'], unique=True)
+    op.create_index('ix_project_members_user_id_project_id', 'project_members', ['user_id', 'project_id'], unique=False)
+    op.create_index('ix_task_assigments_task_id_user_id', 'task_assigments', ['task_id', 'user_id'], unique=False)
+    op.create_index('ix_task_assigments_user_id_task_id', 'task_assigments', ['user_id', 'task_id'], unique=False)
+    op.create_index('ix_tasks_project_id_priority_id', 'tasks', ['project_id', sa.text('coalesce(priority, 0) DESC'), 'id'], unique=False)
+    op.create_index('ix_tasks_sprint_id_priority_id', 'tasks', ['sprint_id', sa.text('coalesce(priority, 0) DESC'), 'id'], unique=False)
+    op.create_index('ix_tasks_sprint_id_completion_date', 'tasks', ['sprint_id', 'completion_date'], unique=False)
+    op.create_index('ix_comments_task_id_creation_date_id', 'comments', ['task_id', 'creation_date', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_task_id_creation_date_id', table_name='comments')
+    op.drop_index('ix_tasks_sprint_id_completion_date', table_name='tasks')
+    op.drop_index('ix_tasks_sprint_id_priority_id', table_name='tasks')
+    op.drop_index('ix_tasks_project_id_priority_id', table_name='tasks')
+    op.drop_index('ix_task_assigments_user_id_task_id', table_name='task_assigments')
+    op.drop_index('ix_task_assigments_task_id_user_id', table_name='task_assigments')
+    op.drop_index('ix_project_members_user_id_project_id', table_name='project_members')
+    op.drop_index('ix_project_members_project_id_user_id', table_name='project_members')
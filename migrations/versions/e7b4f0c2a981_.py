@@ -0,0 +1,26 @@
+"""empty message
+
+Revision ID: e7b4f0c2a981
+Revises: 9d3c6b1a7e52
+Create Date: 2026-10-19 10:05:31.224817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b4f0c2a981'
+down_revision = '9d3c6b1a7e52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_comments_task_id_creation_date_id', table_name='comments')
+    op.create_index('ix_comments_task_id_sort_date_id', 'comments', ['task_id', sa.text("coalesce(creation_date, '1970-01-01 00:00:00.000000')"), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_task_id_sort_date_id', table_name='comments')
+    op.create_index('ix_comments_task_id_creation_date_id', 'comments', ['task_id', 'creation_date', 'id'], unique=False)
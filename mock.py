@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import faker
 from datetime import datetime, timedelta
 
@@ -16,6 +17,8 @@ class Config:
     TASK_COUNT = 500
     TASK_ASSIGNEES_MAX = 3
     COMMENT_COUNT = 1000
+    CHUNK_SIZE = 5000
+    TEXT_POOL_SIZE = 1000
 
 def gen_unique(existing, gen):
     x = None
@@ -205,6 +208,8 @@ class Mocker:
     def mock(self):
         if self.superuser:
             models.db.make_transient(self.superuser)
+        models.db.session.execute(models.task_assigments.delete())
+        models.db.session.execute(models.project_members.delete())
         models.db.session.query(models.Comment).delete()
         models.db.session.query(models.Task).delete()
         models.db.session.query(models.Sprint).delete()
@@ -220,8 +225,269 @@ class Mocker:
         self.mock_tasks()
         self.mock_comments()
 
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class FastMocker(Mocker):
+    """Generates the same kind of data as Mocker at much larger scale.
+
+    Random picks are made from entities kept in memory, texts come from
+    pools generated up front, the shared password is hashed once and rows
+    are inserted in chunks with multi-row INSERTs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        random = self.fake.random
+        self.random = random
+        self.now = datetime.now()
+        size = Config.TEXT_POOL_SIZE
+        self.sentences = [self.fake.sentence() for i in range(size)]
+        self.paragraphs = [self.fake.paragraph() for i in range(size)]
+        self.user_ids = []
+        self.project_members = {}
+        self.project_sprints = {}
+        self.tasks = []
+
+    def insert(self, table, rows, returning=False):
+        ids = []
+        for chunk in chunked(rows, Config.CHUNK_SIZE):
+            chunk_ids = models.bulk_insert(models.db.session, table, chunk,
+                                           returning=returning)
+            if returning:
+                ids.extend(chunk_ids)
+        return ids
+
+    def date_time_between(self, start, end):
+        seconds = max(int((end - start).total_seconds()), 1)
+        return start + timedelta(seconds=self.random.randrange(seconds))
+
+    def mock_users(self):
+        print('[*] Users')
+
+        user = models.User()
+        user.hash_password(Config.USER_PASSWORD)
+        first_names = [self.fake.first_name() for i in range(100)]
+        last_names = [self.fake.last_name() for i in range(100)]
+        user_names = [self.fake.user_name() for i in range(100)]
+
+        def rows():
+            for i in range(Config.USER_COUNT):
+                username = '{}{}'.format(self.random.choice(user_names), i)
+                yield {
+                    'username': username,
+                    'password_hash': user.password_hash,
+                    'full_name': self.random.choice(first_names) + ' ' +
+                                 self.random.choice(last_names),
+                    'email': username + '@example.com',
+                    'avatar': None
+                }
+
+        self.user_ids = self.insert(models.User.__table__, rows(),
+                                    returning=True)
+        models.db.session.commit()
+
+    def mock_projects(self):
+        print('[*] Projects')
+
+        aliases = set()
+        rows = []
+        for i in range(Config.PROJECT_COUNT):
+            alias = gen_unique(aliases, lambda: self.fake.word())
+            if len(aliases) > 500:
+                alias = '{}-{}'.format(alias, i)
+            aliases.add(alias)
+            rows.append({
+                'alias': alias,
+                'name': self.fake.catch_phrase(),
+                'description': self.random.choice(self.paragraphs),
+                'vcs_link': self.fake.url(),
+                'bts_link': self.fake.url(),
+                'cis_link': self.fake.url(),
+                'version': 0
+            })
+        project_ids = self.insert(models.Project.__table__, rows,
+                                  returning=True)
+
+        memberships = []
+        for project_id in project_ids:
+            member_count = self.random.randrange(1, Config.PROJECT_MEMBERS_MAX)
+            member_count = min(member_count, len(self.user_ids))
+            members = self.random.sample(self.user_ids, member_count)
+            if self.superuser:
+                members.append(self.superuser.id)
+            self.project_members[project_id] = members
+            self.project_sprints[project_id] = []
+            memberships.extend({'project_id': project_id, 'user_id': x}
+                               for x in members)
+        self.insert(models.project_members, memberships)
+
+        models.db.session.commit()
+
+    def mock_sprints(self):
+        print('[*] Sprints')
+
+        project_ids = list(self.project_members)
+        rows = []
+        for i in range(Config.SPRINT_COUNT):
+            start_date = self.date_time_between(
+                self.now - timedelta(days=365), self.now).date()
+            end_date = start_date + timedelta(days=self.random.randrange(7, 42))
+            rows.append({
+                'project_id': self.random.choice(project_ids),
+                'start_date': start_date,
+                'end_date': end_date,
+                'goal': self.random.choice(self.sentences)
+            })
+        sprint_ids = self.insert(models.Sprint.__table__, rows, returning=True)
+        for sprint_id, row in zip(sprint_ids, rows):
+            self.project_sprints[row['project_id']].append(
+                (sprint_id, row['start_date'], row['end_date']))
+
+        models.db.session.commit()
+
+    def gen_task(self, project_id, next_bts_ticket):
+        random = self.random
+        sprint = None
+        if self.project_sprints[project_id] and random.random() < 0.8:
+            sprint = random.choice(self.project_sprints[project_id])
+
+        if sprint:
+            sprint_start = datetime.combine(sprint[1], datetime.min.time())
+            creation_date = self.date_time_between(
+                sprint_start - timedelta(days=365),
+                sprint_start - timedelta(days=1))
+        else:
+            creation_date = self.date_time_between(
+                self.now - timedelta(days=3 * 365), self.now)
+
+        kind = random.choice(list(models.TaskKind))
+        row = {
+            'project_id': project_id,
+            'sprint_id': sprint[0] if sprint else None,
+            'parent_task_id': None,
+            'author_id': random.choice(self.project_members[project_id]),
+            'title': random.choice(self.sentences),
+            'creation_date': creation_date,
+            'status': random.choice([models.TaskStatus.BACKLOG,
+                                     models.TaskStatus.IN_PROCESS]),
+            'kind': kind,
+            'priority': random.randrange(-2, 2),
+            'acceptance_criteria': None,
+            'user_story': None,
+            'initial_estimate': None,
+            'vcs_commit': None,
+            'bts_ticket': None,
+            'completion_date': None,
+            'time_spent': None,
+            'effort': None,
+            'version': 0
+        }
+        if random.random() < 0.2:
+            row['acceptance_criteria'] = random.choice(self.paragraphs)
+        if random.random() < 0.4:
+            row['user_story'] = random.choice(self.paragraphs)
+        if random.random() < 0.3:
+            row['initial_estimate'] = random.randrange(1, 30)
+        if random.random() < 0.3:
+            row['vcs_commit'] = '%040x' % random.getrandbits(160)
+        if kind == models.TaskKind.BUG and random.random() < 0.6:
+            row['bts_ticket'] = next_bts_ticket
+        if sprint and random.random() < 0.8:
+            sprint_end = datetime.combine(sprint[2], datetime.min.time())
+            row['status'] = models.TaskStatus.DONE
+            row['completion_date'] = self.date_time_between(
+                sprint_start + timedelta(days=1), sprint_end)
+            if random.random() < 0.5:
+                row['time_spent'] = random.randrange(1, 100)
+            if random.random() < 0.5:
+                row['effort'] = round(random.random() * 10, 2)
+        if self.tasks and random.random() < 0.2:
+            row['parent_task_id'] = random.choice(self.tasks)[0]
+        return row
+
+    def mock_tasks(self):
+        print('[*] Tasks')
+
+        project_ids = list(self.project_members)
+        next_bts_ticket = 1
+        for i in range(0, Config.TASK_COUNT, Config.CHUNK_SIZE):
+            rows = []
+            for j in range(min(Config.CHUNK_SIZE, Config.TASK_COUNT - i)):
+                row = self.gen_task(self.random.choice(project_ids),
+                                    next_bts_ticket)
+                if row['bts_ticket']:
+                    next_bts_ticket += 1
+                rows.append(row)
+            task_ids = models.bulk_insert(models.db.session,
+                                          models.Task.__table__, rows,
+                                          returning=True)
+
+            assignments = []
+            for task_id, row in zip(task_ids, rows):
+                members = self.project_members[row['project_id']]
+                assignee_count = self.random.randrange(1, max(2, min(
+                    len(members), Config.TASK_ASSIGNEES_MAX)))
+                assignments.extend(
+                    {'task_id': task_id, 'user_id': x}
+                    for x in self.random.sample(members, assignee_count))
+                self.tasks.append((task_id, row['project_id'],
+                                   row['creation_date']))
+            models.bulk_insert(models.db.session, models.task_assigments,
+                               assignments)
+            print('    {}/{}'.format(len(self.tasks), Config.TASK_COUNT))
+
+        models.db.session.commit()
+
+    def mock_comments(self):
+        print('[*] Comments')
+
+        def rows():
+            for i in range(Config.COMMENT_COUNT):
+                task_id, project_id, creation_date = \
+                    self.random.choice(self.tasks)
+                yield {
+                    'task_id': task_id,
+                    'author_id': self.random.choice(
+                        self.project_members[project_id]),
+                    'creation_date': self.date_time_between(creation_date,
+                                                            self.now),
+                    'message': self.random.choice(self.paragraphs)
+                }
+
+        self.insert(models.Comment.__table__, rows())
+        models.db.session.commit()
+
 def main():
-    mocker = Mocker()
+    parser = argparse.ArgumentParser(description='Fill the database with '
+                                                 'fake data.')
+    parser.add_argument('--fast', action='store_true',
+                        help='use bulk inserts, for large sizes')
+    parser.add_argument('--seed', type=int, default=Config.SEED)
+    parser.add_argument('--users', type=int, default=Config.USER_COUNT)
+    parser.add_argument('--projects', type=int, default=Config.PROJECT_COUNT)
+    parser.add_argument('--sprints', type=int, default=Config.SPRINT_COUNT)
+    parser.add_argument('--tasks', type=int, default=Config.TASK_COUNT)
+    parser.add_argument('--comments', type=int, default=Config.COMMENT_COUNT)
+    parser.add_argument('--chunk-size', type=int, default=Config.CHUNK_SIZE)
+    args = parser.parse_args()
+
+    Config.SEED = args.seed
+    Config.USER_COUNT = args.users
+    Config.PROJECT_COUNT = args.projects
+    Config.SPRINT_COUNT = args.sprints
+    Config.TASK_COUNT = args.tasks
+    Config.COMMENT_COUNT = args.comments
+    Config.CHUNK_SIZE = args.chunk_size
+
+    mocker = FastMocker() if args.fast else Mocker()
     mocker.mock()
 
 if __name__ == '__main__':
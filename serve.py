@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Serves the API from a single process with cooperative concurrency.
+
+Every connection is handled by a greenlet instead of a thread. Sockets,
+locks, sleeps and (through psycogreen) psycopg2 queries yield to other
+connections while they wait, so a process can keep many clients, e.g.
+pollers doing conditional GETs, served while the database is slow; compare
+with other servers using bench.py --pollers and SQL_SIMULATED_LATENCY.
+Password hashing still runs on OS threads. Requires the packages listed in
+requirements-gevent.txt.
+"""
+import argparse
+
+from gevent import monkey
+monkey.patch_all()
+
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+def patch_database_driver():
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        print('[!] psycogreen is not installed, database calls will block')
+        return
+    patch_psycopg()
+
+def hash_on_native_threads():
+    """Hashes passwords on OS threads of the hub's threadpool.
+
+    Patched threads are greenlets, so pbkdf2 would otherwise hold the hub
+    and stall every other connection for the duration of a login.
+    """
+    from gevent.threadpool import ThreadPoolExecutor
+    from server import passwords
+    passwords.executor.executor_class = ThreadPoolExecutor
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the API with '
+                                                 'gevent.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--connections', type=int, default=5000,
+                        help='maximum number of concurrent connections')
+    args = parser.parse_args()
+
+    patch_database_driver()
+    from server import app
+    hash_on_native_threads()
+
+    server = WSGIServer((args.host, args.port), app,
+                        spawn=Pool(args.connections), log=None)
+    print('[*] Serving on http://{}:{}'.format(args.host, args.port))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
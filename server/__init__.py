@@ -8,5 +8,8 @@ app.config.from_envvar('SCRUM_API_CONFIG', silent=True)
 
 import server.commands
 import server.models
+import server.instrumentation
 import server.schemas
 import server.resources
+import server.metrics
+import server.profiling
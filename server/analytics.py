@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+from server import models
+
+TASK_COLUMNS = [models.Task.sprint_id, models.Task.status,
+                models.Task.creation_date, models.Task.completion_date,
+                models.Task.time_spent, models.Task.initial_estimate,
+                models.Task.effort]
+
+def task_columns_query(*criteria):
+    return models.db.session.query(*TASK_COLUMNS).filter(*criteria)
+
+def percentile(ordered, p):
+    """Linearly interpolated percentile of an already sorted list."""
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * \
+        (position - lower)
+
+def distribution(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': round(percentile(ordered, 50), 3),
+        'p85': round(percentile(ordered, 85), 3),
+        'p95': round(percentile(ordered, 95), 3)
+    }
+
+def summarize(rows):
+    """Aggregates rows of TASK_COLUMNS.
+
+    The rows are transposed into columns once and every statistic is a
+    single pass over the columns it needs.
+    """
+    columns = list(zip(*rows)) or [()] * len(TASK_COLUMNS)
+    _, statuses, created, completed, spent, estimates, efforts = columns
+    done = [x == models.TaskStatus.DONE for x in statuses]
+
+    status_counts = defaultdict(int)
+    for status in statuses:
+        if status is not None:
+            status_counts[status.name] += 1
+    lead_times = [(end - start).total_seconds() / 86400
+                  for start, end in zip(created, completed)
+                  if start is not None and end is not None]
+    accuracy = [x / estimate for x, estimate in zip(spent, estimates)
+                if x is not None and estimate]
+
+    return {
+        'taskCount': len(rows),
+        'statusCounts': dict(status_counts),
+        'completedCount': sum(done),
+        'effort': sum(x or 0 for x in efforts),
+        'completedEffort': sum(x or 0 for x, d in zip(efforts, done) if d),
+        'timeSpent': sum(x or 0 for x in spent),
+        'initialEstimate': sum(x or 0 for x in estimates),
+        'leadTimeDays': distribution(lead_times),
+        'estimateAccuracy': distribution(accuracy)
+    }
+
+def group_by_sprint(rows):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[row[0]].append(row)
+    return groups
@@ -0,0 +1,257 @@
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+class TTLCache:
+    """Thread-safe LRU mapping whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate):
+        with self._lock:
+            for key in [x for x in self._entries if predicate(x)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class LocalBackend:
+    """In-process LRU backend."""
+
+    def __init__(self, max_size, ttl):
+        self._entries = TTLCache(max_size, ttl)
+
+    def get(self, scope, key):
+        return self._entries.get((scope, key))
+
+    def set(self, scope, key, value):
+        self._entries.set((scope, key), value)
+
+    def invalidate(self, scope):
+        self._entries.delete_matching(lambda x: x[0] == scope)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisBackend:
+    """Backend shared between processes through Redis.
+
+    Keys of a scope live under a generation number; invalidating the scope
+    bumps the generation and leaves the old keys to expire.
+    """
+
+    def __init__(self, url, ttl, prefix='scrum:response:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _generation_key(self, scope):
+        return '%sgeneration:%s' % (self.prefix, scope)
+
+    def _key(self, scope, key):
+        generation = self.client.get(self._generation_key(scope)) or b'0'
+        return '%s%s:%s:%s' % (self.prefix, scope, generation.decode(), key)
+
+    def get(self, scope, key):
+        value = self.client.get(self._key(scope, key))
+        if value is None:
+            return None
+        return json.loads(value.decode())
+
+    def set(self, scope, key, value):
+        self.client.set(self._key(scope, key), json.dumps(value), ex=self.ttl)
+
+    def invalidate(self, scope):
+        self.client.incr(self._generation_key(scope))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def __len__(self):
+        return 0
+
+class LocalVersions:
+    """Version counters of this process."""
+
+    def __init__(self):
+        self._versions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, names):
+        with self._lock:
+            return [self._versions.get(x, 0) for x in names]
+
+    def bump(self, names):
+        with self._lock:
+            for name in names:
+                self._versions[name] += 1
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+class RedisVersions:
+    """Version counters shared between processes through Redis."""
+
+    def __init__(self, url, prefix='scrum:version:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, names):
+        values = self.client.mget([self.prefix + x for x in names])
+        return [int(x or 0) for x in values]
+
+    def bump(self, names):
+        pipeline = self.client.pipeline(transaction=False)
+        for name in names:
+            pipeline.incr(self.prefix + name)
+        pipeline.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+class MembershipCache:
+    """Caches whether users are members of projects.
+
+    Entries are kept per process, but their keys include version counters of
+    the user and of the project. Bumping the counters of a shared backend
+    makes every process miss the stale entries, which are left to expire.
+    Keys must be taken before reading the membership from the database so
+    that a concurrent change cannot be cached under the new versions.
+    """
+
+    def __init__(self, max_size, ttl, versions):
+        self._entries = TTLCache(max_size, ttl)
+        self.versions = versions
+
+    @property
+    def hits(self):
+        return self._entries.hits
+
+    @property
+    def misses(self):
+        return self._entries.misses
+
+    def keys(self, user_id, project_ids):
+        """Returns {project_id: key} for the current versions."""
+        project_ids = list(project_ids)
+        user_version, *project_versions = self.versions.get(
+            ['user:%s' % user_id] + ['project:%s' % x for x in project_ids])
+        return {x: (user_id, x, user_version, version)
+                for x, version in zip(project_ids, project_versions)}
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, is_member):
+        self._entries.set(key, is_member)
+
+    def invalidate(self, user_ids=(), project_ids=()):
+        self.versions.bump(['user:%s' % x for x in user_ids] +
+                           ['project:%s' % x for x in project_ids])
+
+    def clear(self):
+        self._entries.clear()
+        self.versions.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, scope, key):
+        value = self.backend.get(scope, key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, scope, key, value):
+        self.backend.set(scope, key, value)
+
+    def invalidate(self, scope):
+        self.backend.invalidate(scope)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.backend)
+        }
+
+def make_response_cache(config):
+    backend = config['RESPONSE_CACHE_BACKEND']
+    if backend is None:
+        return None
+    if backend == 'local':
+        return ResponseCache(LocalBackend(config['RESPONSE_CACHE_SIZE'],
+                                          config['RESPONSE_CACHE_TTL']))
+    if backend == 'redis':
+        return ResponseCache(RedisBackend(config['RESPONSE_CACHE_REDIS_URL'],
+                                          config['RESPONSE_CACHE_TTL']))
+    raise ValueError('Unknown response cache backend: %s' % backend)
+
+def make_membership_cache(config):
+    backend = config['MEMBERSHIP_CACHE_BACKEND']
+    if backend == 'local':
+        versions = LocalVersions()
+    elif backend == 'redis':
+        versions = RedisVersions(config['MEMBERSHIP_CACHE_REDIS_URL'])
+    else:
+        raise ValueError('Unknown membership cache backend: %s' % backend)
+    return MembershipCache(config['MEMBERSHIP_CACHE_SIZE'],
+                           config['MEMBERSHIP_CACHE_TTL'], versions)
@@ -1,3 +1,8 @@
+import json
+import os
+import re
+from datetime import datetime
+
 import click
 import sqlalchemy
 
@@ -61,3 +66,124 @@ def remove_from_project(project_alias, username):
     project.members.remove(user)
     models.db.session.add(project)
     models.db.session.commit()
+
+def sequential_scans(query):
+    """Returns the tables that the database would scan sequentially."""
+    dialect = models.db.session.bind.dialect
+    compiled = query.statement.compile(dialect=dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[x] for x in compiled.positiontup)
+    cursor = models.db.session.connection().connection.cursor()
+
+    if dialect.name == 'postgresql':
+        # Only fall back to a sequential scan when no index can be used
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), params)
+        nodes = [cursor.fetchone()[0][0]['Plan']]
+        tables = set()
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                tables.add(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return tables
+
+    if dialect.name == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+        tables = set()
+        for row in cursor.fetchall():
+            match = re.match(r'SCAN (?:TABLE )?(\w+)', row[-1])
+            if match and match.group(1) in models.db.metadata.tables:
+                tables.add(match.group(1))
+        return tables
+
+    raise click.ClickException('Unsupported database: %s' % dialect.name)
+
+@app.cli.command()
+def check_indexes():
+    from server import resources
+
+    user_id, project_id = models.db.session\
+        .query(models.project_members.c.user_id,
+               models.project_members.c.project_id)\
+        .first()
+    sprint = models.Sprint.query.filter_by(project_id=project_id).first()
+    task = models.Task.query.filter_by(project_id=project_id).first()
+    if not sprint or not task:
+        raise click.ClickException('Seed the database first')
+
+    project_tasks = models.Task.query.filter_by(project_id=project_id)
+    sprint_tasks = models.Task.query.filter_by(sprint_id=sprint.id)
+    task_comments = models.Comment.query.filter_by(task_id=task.id)
+    page_size = app.config['MAX_PAGE_SIZE'] + 1
+    queries = [
+        ('membership', resources.membership_query(user_id, project_id)),
+        ('member projects', resources.member_projects_query(user_id)),
+        ('current sprints', resources.current_sprints_query(
+            [project_id], datetime.now().date())),
+        ('sprint number', resources.sprint_number_query(sprint)),
+        ('project tasks', resources.keyset(
+            project_tasks, resources.TASK_ORDER).limit(page_size)),
+        ('sprint tasks', resources.keyset(
+            sprint_tasks, resources.TASK_ORDER).limit(page_size)),
+        ('project tasks by date', resources.keyset(
+            project_tasks, resources.TASK_SORTS['-created'][0])
+            .limit(page_size)),
+        ('sprint tasks by date', resources.keyset(
+            sprint_tasks, resources.TASK_SORTS['created'][0])
+            .limit(page_size)),
+        ('assigned tasks', resources.assigned_tasks_query(
+            user_id, [task.id])),
+        ('assigned streamed tasks', resources.assigned_tasks_query(
+            user_id, project_tasks.with_entities(models.Task.id))),
+        ('burndown', resources.completions_query([sprint.id])),
+        ('task comments', resources.keyset(
+            task_comments, resources.COMMENT_ORDER).limit(page_size))
+    ]
+
+    failed = False
+    for name, query in queries:
+        tables = sequential_scans(query)
+        if tables:
+            print('[!] {}: sequential scan on {}'.format(
+                name, ', '.join(sorted(tables))))
+            failed = True
+        else:
+            print('[*] {}'.format(name))
+    models.db.session.rollback()
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command()
+@click.option('--limit', default=20, help='Number of statements to show.')
+@click.option('--resource', help='Only show statements of this resource.')
+@click.option('--slowest', is_flag=True,
+              help='Order by duration instead of time.')
+@click.option('--plans/--no-plans', default=True)
+def slow_queries(limit, resource, slowest, plans):
+    path = app.config['SLOW_QUERY_LOG_FILE']
+    paths = [path] + ['{}.{}'.format(path, i) for i in
+                      range(1, app.config['SLOW_QUERY_LOG_BACKUPS'] + 1)]
+    entries = []
+    for x in paths:
+        if not os.path.exists(x):
+            continue
+        with open(x) as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    if resource:
+        entries = [x for x in entries if x['resource'] == resource]
+    if slowest:
+        entries.sort(key=lambda x: x['duration_ms'], reverse=True)
+    else:
+        entries.sort(key=lambda x: x['time'], reverse=True)
+
+    for entry in entries[:limit]:
+        print('[*] {} {:.2f} ms {} {} ({})'.format(
+            entry['time'], entry['duration_ms'], entry['method'] or '-',
+            entry['path'] or '-', entry['resource'] or 'no request'))
+        print(entry['statement'])
+        print('Parameters: {}'.format(entry['parameters']))
+        if plans and entry['plan']:
+            print(entry['plan'])
+        print()
@@ -0,0 +1,193 @@
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool
+
+from server import app
+
+class RequestStats:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0
+        self.statements = []
+
+def get_request_stats():
+    if not has_request_context():
+        return None
+    if 'request_stats' not in g:
+        g.request_stats = RequestStats()
+    return g.request_stats
+
+def resource_name():
+    view = app.view_functions.get(request.endpoint)
+    if view is None:
+        return 'unmatched'
+    return getattr(view, 'view_class', view).__name__
+
+slow_query_log = logging.getLogger('server.slow_queries')
+slow_query_log.propagate = False
+if app.config['SLOW_QUERY_THRESHOLD'] is not None:
+    slow_query_log.setLevel(logging.INFO)
+    slow_query_log.addHandler(RotatingFileHandler(
+        app.config['SLOW_QUERY_LOG_FILE'],
+        maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+        backupCount=app.config['SLOW_QUERY_LOG_BACKUPS']))
+
+class SlowQueryLogger:
+    """Writes slow statements with their plans from a background thread.
+
+    Requests only enqueue entries, so logging never adds latency to them or
+    fails them. Plans are taken on dedicated unpooled engines: the request's
+    pool is likely exhausted when statements are slow, and its connection
+    may be in the middle of a transaction. Entries arriving while the queue
+    is full are dropped.
+    """
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self._engines = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, url, entry, explain):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='slow-query-log')
+                self._thread.start()
+        try:
+            self.queue.put_nowait((url, entry, explain))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            url, entry, explain = self.queue.get()
+            try:
+                if explain:
+                    entry['plan'] = self.explain(url, entry['statement'],
+                                                 entry['parameters'])
+                slow_query_log.info(json.dumps(entry, default=str))
+            except Exception:
+                app.logger.exception('Cannot log a slow query')
+
+    def explain(self, url, statement, parameters):
+        """Returns the plan of a statement, computed on a new connection."""
+        if url.get_backend_name() == 'postgresql':
+            analyze = (app.config['SLOW_QUERY_EXPLAIN_ANALYZE']
+                       and statement.lstrip().upper().startswith('SELECT'))
+            prefix = 'EXPLAIN (ANALYZE) ' if analyze else 'EXPLAIN '
+        elif url.get_backend_name() == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            return None
+
+        engine = self._engines.get(url)
+        if engine is None:
+            engine = self._engines[url] = sqlalchemy.create_engine(
+                url, poolclass=NullPool)
+        connection = None
+        try:
+            connection = engine.raw_connection()
+            cursor = connection.cursor()
+            cursor.execute(prefix + statement, parameters)
+            plan = '\n'.join(str(row[-1]) for row in cursor.fetchall())
+            cursor.close()
+            connection.rollback()
+            return plan
+        except Exception as e:
+            return 'EXPLAIN failed: {}'.format(e)
+        finally:
+            if connection is not None:
+                connection.close()
+
+slow_query_logger = SlowQueryLogger(app.config['SLOW_QUERY_QUEUE_SIZE'])
+
+def log_slow_query(conn, statement, parameters, executemany, elapsed):
+    entry = {
+        'time': datetime.now().isoformat(),
+        'duration_ms': round(elapsed * 1000, 2),
+        'statement': statement,
+        'parameters': parameters,
+        'resource': None,
+        'method': None,
+        'path': None,
+        'plan': None
+    }
+    if has_request_context():
+        entry.update(resource=resource_name(), method=request.method,
+                     path=request.path)
+    slow_query_logger.submit(conn.engine.url, entry, not executemany)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context,
+                      executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+    if app.config['SQL_SIMULATED_LATENCY']:
+        time.sleep(app.config['SQL_SIMULATED_LATENCY'] / 1000)
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    threshold = app.config['SLOW_QUERY_THRESHOLD']
+    if threshold is not None and elapsed * 1000 >= threshold:
+        log_slow_query(conn, statement, parameters, executemany, elapsed)
+    stats = get_request_stats()
+    if stats is None:
+        return
+    stats.query_count += 1
+    stats.query_time += elapsed
+    if (app.config['SQL_QUERY_THRESHOLD'] is not None
+            and len(stats.statements) < app.config['SQL_LOGGED_STATEMENTS']):
+        stats.statements.append((statement, elapsed))
+
+@app.before_request
+def start_request_timer():
+    get_request_stats()
+
+@app.after_request
+def add_server_timing(response):
+    """Reports the database work done while handling the request.
+
+    Streamed responses are reported when the headers are sent, so queries
+    made while generating the body are not included.
+    """
+    stats = get_request_stats()
+    total = time.perf_counter() - stats.start
+    if app.config['SERVER_TIMING']:
+        response.headers.add(
+            'Server-Timing',
+            'db;desc="{} queries";dur={:.2f}, app;dur={:.2f}'.format(
+                stats.query_count, stats.query_time * 1000, total * 1000))
+
+    if app.config['REQUEST_LOG']:
+        app.logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 2),
+            'db_queries': stats.query_count,
+            'db_ms': round(stats.query_time * 1000, 2),
+            'db_bind': g.get('db_bind')
+        }, sort_keys=True))
+
+    threshold = app.config['SQL_QUERY_THRESHOLD']
+    if threshold is not None and stats.query_count > threshold:
+        app.logger.warning(
+            '%s %s made %d queries:\n%s', request.method, request.path,
+            stats.query_count,
+            '\n'.join('[{:.2f} ms] {}'.format(elapsed * 1000, statement)
+                      for statement, elapsed in stats.statements))
+    return response
@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from flask import Response, request
+
+from server import app, models, resources
+from server.instrumentation import (get_request_stats, resource_name,
+                                    slow_query_logger)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    """Cumulative-on-export histogram backed by a fixed-size count array."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last slot counts observations above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (resource, method) -> Histogram
+        self.latency = {}
+        # (resource, method, status) -> int
+        self.responses = defaultdict(int)
+        # (resource, method) -> int
+        self.queries = defaultdict(int)
+        self.in_flight = 0
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, resource, method, status, duration, query_count):
+        key = (resource, method)
+        with self._lock:
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            self.responses[(resource, method, status)] += 1
+            self.queries[key] += query_count
+
+metrics = Metrics()
+
+def labels(**kwargs):
+    if not kwargs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                           .replace('"', '\\"'))
+                          for k, v in kwargs.items()) + '}'
+
+def pool_stats():
+    pool = models.db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {}
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow()
+    }
+
+def cache_stats():
+    caches = {'membership': (models.membership_cache.hits,
+                             models.membership_cache.misses)}
+    if resources.response_cache is not None:
+        stats = resources.response_cache.stats()
+        caches['response'] = (stats['hits'], stats['misses'])
+    return caches
+
+def render():
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for suffix, sample_labels, value in samples:
+            lines.append('{}{}{} {}'.format(name, suffix,
+                                            labels(**sample_labels), value))
+
+    with metrics._lock:
+        latency = [(key, list(x.counts), x.sum, x.count)
+                   for key, x in metrics.latency.items()]
+        responses = list(metrics.responses.items())
+        queries = list(metrics.queries.items())
+        in_flight = metrics.in_flight
+
+    samples = []
+    for (resource, method), counts, total, count in sorted(latency):
+        cumulative = 0
+        for bound, bucket_count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += bucket_count
+            samples.append(('_bucket', dict(resource=resource, method=method,
+                                            le=bound), cumulative))
+        samples.append(('_sum', dict(resource=resource, method=method), total))
+        samples.append(('_count', dict(resource=resource, method=method),
+                        count))
+    metric('http_request_duration_seconds', 'histogram',
+           'Request latency by resource and method.', samples)
+
+    metric('http_responses_total', 'counter',
+           'Responses by resource, method and status code.',
+           [('', dict(resource=r, method=m, status=s), x)
+            for (r, m, s), x in sorted(responses)])
+    metric('db_queries_total', 'counter',
+           'SQL statements executed by resource and method.',
+           [('', dict(resource=r, method=m), x)
+            for (r, m), x in sorted(queries)])
+    metric('http_requests_in_flight', 'gauge',
+           'Requests currently being handled.', [('', {}, in_flight)])
+
+    metric('db_pool_connections', 'gauge',
+           'Database connection pool usage.',
+           [('', dict(state=k), v) for k, v in pool_stats().items()])
+
+    metric('slow_queries_dropped_total', 'counter',
+           'Slow statements not logged because the log queue was full.',
+           [('', {}, slow_query_logger.dropped)])
+
+    caches = sorted(cache_stats().items())
+    metric('cache_hits_total', 'counter', 'Cache hits.',
+           [('', dict(cache=k), hits) for k, (hits, misses) in caches])
+    metric('cache_misses_total', 'counter', 'Cache misses.',
+           [('', dict(cache=k), misses) for k, (hits, misses) in caches])
+    metric('cache_hit_ratio', 'gauge', 'Cache hits over all lookups.',
+           [('', dict(cache=k), hits / (hits + misses) if hits + misses else 0)
+            for k, (hits, misses) in caches])
+
+    return '\n'.join(lines) + '\n'
+
+@app.before_request
+def start_metrics():
+    metrics.start()
+
+@app.after_request
+def record_metrics(response):
+    if request.endpoint != 'metrics':
+        stats = get_request_stats()
+        metrics.record(resource_name(), request.method, response.status_code,
+                       time.perf_counter() - stats.start, stats.query_count)
+    return response
+
+@app.teardown_request
+def finish_metrics(error):
+    metrics.finish()
+
+@app.route('/metrics', endpoint='metrics')
+def export_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return Response(status=404)
+    return Response(render(), mimetype='text/plain; version=0.0.4')
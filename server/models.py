@@ -1,14 +1,19 @@
 import enum
+import re
+from datetime import datetime
+from itertools import chain
 
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-from passlib.hash import pbkdf2_sha256
+from server import app, passwords
+from server.cache import make_membership_cache
+from server.replicas import RoutingSQLAlchemy
 
-from server import app
-
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 
+# (user_id, project_id, user version, project version) -> bool
+membership_cache = make_membership_cache(app.config)
+
 class AccessDenied(Exception):
     pass
 
@@ -27,7 +32,10 @@ project_members = db.Table(
     db.Column('user_id', db.Integer,
               db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
     db.Column('project_id', db.Integer,
-              db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
+              db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False),
+    db.Index('ix_project_members_project_id_user_id',
+             'project_id', 'user_id', unique=True),
+    db.Index('ix_project_members_user_id_project_id', 'user_id', 'project_id')
 )
 
 task_assigments = db.Table(
@@ -36,7 +44,9 @@ task_assigments = db.Table(
     db.Column('task_id', db.Integer,
               db.ForeignKey('tasks.id', ondelete='CASCADE'), nullable=False),
     db.Column('user_id', db.Integer,
-              db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+              db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    db.Index('ix_task_assigments_task_id_user_id', 'task_id', 'user_id'),
+    db.Index('ix_task_assigments_user_id_task_id', 'user_id', 'task_id')
 )
 
 class User(db.Model):
@@ -53,10 +63,14 @@ class User(db.Model):
     avatar = db.Column(db.String)
 
     def hash_password(self, password):
-        self.password_hash = pbkdf2_sha256.hash(password)
+        self.password_hash = passwords.hash(password)
 
     def verify_password(self, password):
-        return pbkdf2_sha256.verify(password, self.password_hash)
+        valid, new_hash = passwords.verify_and_update(password,
+                                                      self.password_hash)
+        if new_hash:
+            self.password_hash = new_hash
+        return valid
 
 class Project(db.Model):
     __tablename__ = 'projects'
@@ -74,9 +88,14 @@ class Project(db.Model):
     vcs_link = db.Column(db.String)
     bts_link = db.Column(db.String)
     cis_link = db.Column(db.String)
+    version = db.Column(db.Integer, nullable=False, default=0)
 
 class Sprint(db.Model):
     __tablename__ = 'sprints'
+    __table_args__ = (
+        db.Index('ix_sprints_project_id_start_date_end_date',
+                 'project_id', 'start_date', 'end_date'),
+    )
     id = db.Column(db.Integer, primary_key=True)
 
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
@@ -116,6 +135,19 @@ class Task(db.Model):
     completion_date = db.Column(db.DateTime)
     time_spent = db.Column(db.Integer)
     effort = db.Column(db.Float)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+db.Index('ix_tasks_project_id_priority_id', Task.project_id,
+         db.func.coalesce(Task.priority, 0).desc(), Task.id)
+db.Index('ix_tasks_sprint_id_priority_id', Task.sprint_id,
+         db.func.coalesce(Task.priority, 0).desc(), Task.id)
+db.Index('ix_tasks_sprint_id_completion_date',
+         Task.sprint_id, Task.completion_date)
+db.Index('ix_tasks_project_id_creation_date_id',
+         Task.project_id, Task.creation_date, Task.id)
+db.Index('ix_tasks_sprint_id_creation_date_id',
+         Task.sprint_id, Task.creation_date, Task.id)
+db.Index('ix_tasks_author_id', Task.author_id)
 
 class Comment(db.Model):
     __tablename__ = 'comments'
@@ -128,3 +160,235 @@ class Comment(db.Model):
 
     creation_date = db.Column(db.DateTime)
     message = db.Column(db.Text())
+
+# creation_date is nullable; lists order undated comments first. The
+# literal is inlined so that queries match the index expression.
+COMMENT_EPOCH = datetime(1970, 1, 1)
+comment_sort_date = db.func.coalesce(
+    Comment.creation_date,
+    db.literal_column("'1970-01-01 00:00:00.000000'", db.DateTime))
+
+db.Index('ix_comments_task_id_sort_date_id',
+         Comment.task_id, comment_sort_date, Comment.id)
+db.Index('ix_comments_author_id', Comment.author_id)
+
+# Full-text search documents. PostgreSQL keeps a generated tsvector column
+# with a GIN index on each table; SQLite keeps external-content FTS5 tables
+# in sync through triggers. Neither is mapped, resources query them
+# through search_query().
+SEARCH_DOCUMENTS = {
+    'tasks': ['title', 'user_story', 'acceptance_criteria'],
+    'comments': ['message']
+}
+
+def postgresql_search_ddl(table, columns):
+    document = ' || '.join(
+        "setweight(to_tsvector('simple', coalesce({}, '')), '{}')"
+        .format(column, 'A' if i == 0 else 'B')
+        for i, column in enumerate(columns))
+    return [
+        'ALTER TABLE {0} ADD COLUMN search_vector tsvector '
+        'GENERATED ALWAYS AS ({1}) STORED'.format(table, document),
+        'CREATE INDEX ix_{0}_search_vector ON {0} '
+        'USING gin (search_vector)'.format(table)
+    ]
+
+def sqlite_search_ddl(table, columns):
+    names = ', '.join(columns)
+    new = ', '.join('new.' + x for x in columns)
+    old = ', '.join('old.' + x for x in columns)
+    insert = ('INSERT INTO {0}_fts (rowid, {1}) VALUES (new.id, {2});'
+              .format(table, names, new))
+    delete = ("INSERT INTO {0}_fts ({0}_fts, rowid, {1}) "
+              "VALUES ('delete', old.id, {2});".format(table, names, old))
+    return [
+        "CREATE VIRTUAL TABLE {0}_fts USING fts5({1}, content='{0}', "
+        "content_rowid='id')".format(table, names),
+        'CREATE TRIGGER {0}_fts_insert AFTER INSERT ON {0} '
+        'BEGIN {1} END'.format(table, insert),
+        'CREATE TRIGGER {0}_fts_delete AFTER DELETE ON {0} '
+        'BEGIN {1} END'.format(table, delete),
+        'CREATE TRIGGER {0}_fts_update AFTER UPDATE OF {1} ON {0} '
+        'BEGIN {2} {3} END'.format(table, names, delete, insert)
+    ]
+
+for table, columns in SEARCH_DOCUMENTS.items():
+    for statement in postgresql_search_ddl(table, columns):
+        db.event.listen(db.metadata.tables[table], 'after_create',
+                        db.DDL(statement).execute_if(dialect='postgresql'))
+    for statement in sqlite_search_ddl(table, columns):
+        db.event.listen(db.metadata.tables[table], 'after_create',
+                        db.DDL(statement).execute_if(dialect='sqlite'))
+    db.event.listen(db.metadata.tables[table], 'before_drop',
+                    db.DDL('DROP TABLE IF EXISTS {}_fts'.format(table))
+                    .execute_if(dialect='sqlite'))
+
+def search_query(project_id, text):
+    """Returns a selectable of (rank, kind, id, task_id) rows matching text
+    in the tasks (kind 0) and comments (kind 1) of a project, where a
+    higher rank is a better match."""
+    tasks = Task.__table__
+    comments = Comment.__table__
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        query = db.func.plainto_tsquery('simple', text)
+        def matches(table, *columns):
+            vector = db.literal_column(table.name + '.search_vector')
+            # ts_rank_cd() is a real; as double precision the rank survives
+            # the round trip through cursors exactly
+            rank = db.cast(db.func.ts_rank_cd(vector, query), db.Float)
+            return db.select([rank.label('rank'), *columns])\
+                .where(vector.op('@@')(query))
+    elif dialect == 'sqlite':
+        # Quote every word so that user input is never FTS5 syntax
+        words = re.findall(r'\w+', text)
+        query = ' '.join('"{}"'.format(x) for x in words)
+        def matches(table, *columns):
+            fts = db.table(table.name + '_fts', db.column('rowid'))
+            fts_name = db.literal_column(table.name + '_fts')
+            rank = db.type_coerce(-db.func.bm25(fts_name), db.Float)
+            return db.select([rank.label('rank'), *columns])\
+                .select_from(fts)\
+                .where(fts.c.rowid == table.c.id)\
+                .where(fts_name.match(query))
+    else:
+        raise NotImplementedError(dialect)
+
+    task_matches = matches(tasks,
+                           db.literal_column('0', db.Integer).label('kind'),
+                           tasks.c.id.label('id'),
+                           tasks.c.id.label('task_id'))\
+        .where(tasks.c.project_id == project_id)
+    comment_matches = matches(comments,
+                              db.literal_column('1', db.Integer).label('kind'),
+                              comments.c.id.label('id'),
+                              comments.c.task_id.label('task_id'))\
+        .where(comments.c.task_id == tasks.c.id)\
+        .where(tasks.c.project_id == project_id)
+    return db.union_all(task_matches, comment_matches).alias('matches')
+
+def bump_versions(session, project_ids=(), task_ids=(), user_ids=()):
+    """Increments the version counters of the given projects and tasks.
+
+    Tasks count as changed within their project. A changed user counts as
+    a change of every project they are a member of, and of the tasks they
+    wrote, are assigned to or commented on.
+    """
+    projects = Project.__table__
+    tasks = Task.__table__
+    project_ids = {x for x in project_ids if x is not None}
+    task_ids = {x for x in task_ids if x is not None}
+    user_ids = {x for x in user_ids if x is not None}
+
+    project_clauses = []
+    task_clauses = []
+    if project_ids:
+        project_clauses.append(projects.c.id.in_(project_ids))
+    if task_ids:
+        project_clauses.append(projects.c.id.in_(
+            db.select([tasks.c.project_id]).where(tasks.c.id.in_(task_ids))))
+        task_clauses.append(tasks.c.id.in_(task_ids))
+    if user_ids:
+        member_projects = db.select([project_members.c.project_id])\
+            .where(project_members.c.user_id.in_(user_ids))
+        project_clauses.append(projects.c.id.in_(member_projects))
+        task_clauses.append(tasks.c.author_id.in_(user_ids))
+        task_clauses.append(tasks.c.id.in_(
+            db.select([task_assigments.c.task_id])
+            .where(task_assigments.c.user_id.in_(user_ids))))
+        task_clauses.append(tasks.c.id.in_(
+            db.select([Comment.__table__.c.task_id])
+            .where(Comment.__table__.c.author_id.in_(user_ids))))
+
+    if project_clauses:
+        session.execute(projects.update()
+                        .where(db.or_(*project_clauses))
+                        .values(version=projects.c.version + 1))
+    if task_clauses:
+        session.execute(tasks.update()
+                        .where(db.or_(*task_clauses))
+                        .values(version=tasks.c.version + 1))
+
+def bulk_insert(session, table, rows, returning=False, chunk_size=500):
+    """Inserts rows with as few statements as the database allows.
+
+    With ``returning`` the primary keys of the new rows are returned in the
+    order of ``rows``. On PostgreSQL they are reserved from the key's
+    sequence and inserted explicitly, since the order of rows returned by
+    INSERT ... RETURNING is not guaranteed.
+    """
+    if session.get_bind().dialect.name != 'postgresql':
+        if returning:
+            return [session.execute(table.insert(), x).inserted_primary_key[0]
+                    for x in rows]
+        if rows:
+            session.execute(table.insert(), rows)
+        return None
+
+    ids = None
+    if returning:
+        key, = table.primary_key.columns
+        sequence = db.func.pg_get_serial_sequence(table.name, key.name)
+        ids = [x for x, in session.execute(
+            db.select([db.func.nextval(sequence)])
+            .select_from(db.func.generate_series(1, len(rows))))]
+        rows = [dict(row, **{key.name: x}) for row, x in zip(rows, ids)]
+    for i in range(0, len(rows), chunk_size):
+        session.execute(table.insert().values(rows[i:i + chunk_size]))
+    return ids
+
+@db.event.listens_for(db.session, 'after_flush')
+def bump_flushed_versions(session, flush_context):
+    project_ids = set()
+    task_ids = set()
+    user_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Project):
+            project_ids.add(obj.id)
+        elif isinstance(obj, Sprint):
+            project_ids.add(obj.project_id)
+        elif isinstance(obj, Task):
+            project_ids.add(obj.project_id)
+            task_ids.add(obj.id)
+        elif isinstance(obj, Comment):
+            task_ids.add(obj.task_id)
+        elif isinstance(obj, User) and any(
+                getattr(db.inspect(obj).attrs, x).history.has_changes()
+                for x in ('username', 'full_name', 'email')):
+            user_ids.add(obj.id)
+    bump_versions(session, project_ids, task_ids, user_ids)
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_membership_changes(session, flush_context):
+    user_ids, project_ids = session.info.setdefault('membership_changes',
+                                                    (set(), set()))
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Project):
+            history = db.inspect(obj).attrs.members.history
+            user_ids.update(x.id for x in chain(history.added or (),
+                                                history.deleted or ()))
+        elif (isinstance(obj, User)
+                and db.inspect(obj).attrs.projects.history.has_changes()):
+            user_ids.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            user_ids.add(obj.id)
+        elif isinstance(obj, Project):
+            project_ids.add(obj.id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_memberships(session):
+    """Invalidates cached memberships once their changes are visible."""
+    user_ids, project_ids = session.info.pop('membership_changes',
+                                             (set(), set()))
+    if not user_ids and not project_ids:
+        return
+    try:
+        membership_cache.invalidate(user_ids, project_ids)
+    except Exception:
+        app.logger.exception('Cannot invalidate cached memberships')
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_membership_changes(session):
+    session.info.pop('membership_changes', None)
@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from passlib.context import CryptContext
+
+from server import app
+
+class HashingBusy(Exception):
+    pass
+
+rounds = app.config['PASSWORD_HASH_ROUNDS']
+context = CryptContext(schemes=['pbkdf2_sha256'],
+                       pbkdf2_sha256__default_rounds=rounds,
+                       pbkdf2_sha256__min_desired_rounds=rounds,
+                       pbkdf2_sha256__max_desired_rounds=rounds)
+
+class HashingExecutor:
+    """Runs password hashing on a fixed number of threads.
+
+    At most ``max_pending`` jobs wait for a free thread; submitting more,
+    or waiting longer than ``timeout`` for a result, raises HashingBusy
+    instead of queueing without bound. ``executor_class`` must run jobs on
+    OS threads, which is not the case for ThreadPoolExecutor once gevent
+    has patched the standard library.
+    """
+
+    def __init__(self, max_workers, max_pending, timeout,
+                 executor_class=ThreadPoolExecutor):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.executor_class = executor_class
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self.executor_class(self.max_workers)
+            future = self._executor.submit(fn, *args)
+        except:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+
+executor = HashingExecutor(app.config['HASHING_WORKERS'],
+                           app.config['HASHING_QUEUE_SIZE'],
+                           app.config['HASHING_TIMEOUT'])
+
+def hash(password):
+    return executor.run(context.hash, password)
+
+def verify_and_update(password, password_hash):
+    """Returns (valid, new_hash); new_hash is set when the stored hash was
+    made with different settings and should be replaced."""
+    return executor.run(context.verify_and_update, password, password_hash)
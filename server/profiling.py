@@ -0,0 +1,119 @@
+import cProfile
+import hmac
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from server import app
+
+class ProfilingMiddleware:
+    """Profiles single requests that carry the X-Profile header.
+
+    The header must match PROFILING_TOKEN. Only one request is profiled at
+    a time, at most one every PROFILING_MIN_INTERVAL seconds, and nothing
+    is profiled once PROFILING_DIR holds PROFILING_MAX_FILES profiles;
+    requests over these limits are served normally.
+    """
+
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self._lock = threading.Lock()
+        self._last_started = None
+
+    def __call__(self, environ, start_response):
+        token = self.config['PROFILING_TOKEN']
+        header = environ.get('HTTP_X_PROFILE')
+        if (not self.config['PROFILING_ENABLED'] or not token or not header
+                or not hmac.compare_digest(header.encode(), token.encode())
+                or not self._acquire()):
+            return self.wsgi_app(environ, start_response)
+        try:
+            path = self._output_path(environ)
+        except OSError:
+            self._lock.release()
+            raise
+        if path is None:
+            self._lock.release()
+            return self.wsgi_app(environ, start_response)
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-File', os.path.basename(path)))
+            return start_response(status, headers, exc_info)
+
+        profile = cProfile.Profile()
+        try:
+            response = profile.runcall(self.wsgi_app, environ,
+                                       profiled_start_response)
+        except Exception:
+            self._finish(profile, path)
+            raise
+        return ProfiledResponse(response, profile,
+                                lambda: self._finish(profile, path))
+
+    def _acquire(self):
+        if not self._lock.acquire(blocking=False):
+            return False
+        now = time.monotonic()
+        if (self._last_started is not None and now - self._last_started
+                < self.config['PROFILING_MIN_INTERVAL']):
+            self._lock.release()
+            return False
+        self._last_started = now
+        return True
+
+    def _output_path(self, environ):
+        directory = self.config['PROFILING_DIR']
+        os.makedirs(directory, exist_ok=True)
+        profiles = [x for x in os.listdir(directory) if x.endswith('.prof')]
+        if len(profiles) >= self.config['PROFILING_MAX_FILES']:
+            return None
+        name = '{}-{}-{}.prof'.format(
+            datetime.now().strftime('%Y%m%d%H%M%S%f'),
+            environ.get('REQUEST_METHOD', ''),
+            re.sub(r'[^A-Za-z0-9]+', '_',
+                   environ.get('PATH_INFO', '')).strip('_'))
+        return os.path.join(directory, name)
+
+    def _finish(self, profile, path):
+        try:
+            profile.dump_stats(path)
+        finally:
+            self._lock.release()
+
+class ProfiledResponse:
+    """Keeps profiling while a (possibly streamed) body is iterated."""
+
+    def __init__(self, response, profile, on_close):
+        self.response = response
+        self.iterator = iter(response)
+        self.profile = profile
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.profile.enable()
+        try:
+            return next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            self.profile.disable()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.response, 'close'):
+                self.response.close()
+        finally:
+            self.on_close()
+
+app.wsgi_app = ProfilingMiddleware(app.wsgi_app, app.config)
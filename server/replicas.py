@@ -0,0 +1,137 @@
+import random
+import threading
+
+import sqlalchemy
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import SelectBase
+
+from server import app
+from server.cache import TTLCache
+
+class LocalPins:
+    """Pins kept in this process; only for single-process deployments."""
+
+    def __init__(self, max_size, ttl):
+        self._users = TTLCache(max_size, ttl)
+
+    def pin(self, user_id):
+        self._users.set(user_id, True)
+
+    def is_pinned(self, user_id):
+        return self._users.get(user_id, False)
+
+    def clear(self):
+        self._users.clear()
+
+class RedisPins:
+    """Pins shared by every process through Redis keys that expire."""
+
+    def __init__(self, url, ttl, prefix='scrum:pin:'):
+        import redis
+        self.client = redis.StrictRedis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def pin(self, user_id):
+        self.client.set(self.prefix + str(user_id), 1, ex=self.ttl)
+
+    def is_pinned(self, user_id):
+        return bool(self.client.exists(self.prefix + str(user_id)))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+def make_pins(config):
+    backend = config['REPLICA_PIN_BACKEND']
+    if backend == 'local':
+        return LocalPins(config['REPLICA_PINNED_USERS'],
+                         config['REPLICA_READ_YOUR_WRITES'])
+    if backend == 'redis':
+        return RedisPins(config['REPLICA_PIN_REDIS_URL'],
+                         config['REPLICA_READ_YOUR_WRITES'])
+    raise ValueError('Unknown replica pin backend: %s' % backend)
+
+# Users who wrote recently read from the primary until their pin expires
+pinned_users = None
+if app.config['SQLALCHEMY_REPLICA_URIS']:
+    pinned_users = make_pins(app.config)
+
+class RoutingSession(SignallingSession):
+    """Sends reads made by GET requests to a replica.
+
+    Flushes and every statement that is not a SELECT go to the primary, as
+    do all reads outside of requests and reads by users who wrote within
+    the last REPLICA_READ_YOUR_WRITES seconds. A request sticks to the
+    replica it first picked.
+    """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        primary = super().get_bind(mapper, clause)
+        if not has_request_context():
+            return primary
+        if self._flushing or not isinstance(clause, SelectBase):
+            g.db_wrote = True
+            return primary
+        if 'db_bind' not in g:
+            g.db_bind = self.choose_bind()
+        if g.db_bind == 'primary':
+            return primary
+        return self.db.get_replica(g.db_bind)
+
+    def choose_bind(self):
+        replicas = self.app.config['SQLALCHEMY_REPLICA_URIS']
+        if not replicas or request.method not in ('GET', 'HEAD'):
+            return 'primary'
+        user_id = get_jwt_identity()
+        if user_id is not None:
+            try:
+                if pinned_users.is_pinned(user_id):
+                    return 'primary'
+            except Exception:
+                app.logger.exception('Cannot check replica pins')
+                return 'primary'
+        return random.randrange(len(replicas))
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def __init__(self, *args, **kwargs):
+        self._replicas = {}
+        self._replicas_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_replica(self, index):
+        engine = self._replicas.get(index)
+        if engine is None:
+            with self._replicas_lock:
+                engine = self._replicas.get(index)
+                if engine is None:
+                    engine = sqlalchemy.create_engine(
+                        app.config['SQLALCHEMY_REPLICA_URIS'][index],
+                        **app.config['SQLALCHEMY_REPLICA_ENGINE_OPTIONS'])
+                    self._replicas[index] = engine
+        return engine
+
+@app.after_request
+def pin_writers(response):
+    if g.get('db_wrote') and app.config['SQLALCHEMY_REPLICA_URIS']:
+        user_id = get_jwt_identity()
+        if user_id is not None:
+            try:
+                pinned_users.pin(user_id)
+            except Exception:
+                app.logger.exception('Cannot pin user %s to the primary',
+                                     user_id)
+                return response
+            app.logger.info('Reading from the primary for user %s for %s s',
+                            user_id, app.config['REPLICA_READ_YOUR_WRITES'])
+    return response
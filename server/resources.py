@@ -1,14 +1,40 @@
+import hashlib
+import json
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import defaultdict
 from datetime import datetime, timedelta
 
-from flask import jsonify
+from flask import Response, g, jsonify, request, stream_with_context
 from flask_jwt_extended import (JWTManager, jwt_required,
-                                create_access_token, get_jwt_identity)
-from flask_restful import Api, Resource, reqparse
+                                create_access_token, get_jwt_claims,
+                                get_jwt_identity)
+from flask_restful import Api, Resource, abort, inputs, reqparse
+from sqlalchemy.orm import joinedload
 
-from server import app, models, schemas
+from server import analytics, app, models, passwords, schemas
+from server.cache import make_response_cache
 
 api = Api(app, prefix='/v1')
 jwt = JWTManager(app)
+response_cache = make_response_cache(app.config)
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+TASK_ORDER = [(models.db.func.coalesce(models.Task.priority, 0), True),
+              (models.Task.id, False)]
+# sort parameter -> (keyset keys, key values of a task)
+TASK_SORTS = {
+    'priority': (TASK_ORDER, lambda x: (x.priority or 0, x.id)),
+    'created': ([(models.Task.creation_date, False), (models.Task.id, False)],
+                lambda x: (x.creation_date, x.id)),
+    '-created': ([(models.Task.creation_date, True), (models.Task.id, True)],
+                 lambda x: (x.creation_date, x.id))
+}
+SPRINT_NUMBER = models.db.func.row_number().over(
+    partition_by=models.Sprint.project_id,
+    order_by=(models.Sprint.start_date, models.Sprint.id))
+COMMENT_ORDER = [(models.comment_sort_date, False),
+                 (models.Comment.id, False)]
 
 class NotFound(Exception):
     pass
@@ -28,22 +54,89 @@ def handle_access_denied(error):
     response.status_code = 403
     return response
 
+class CurrentUser:
+    def __init__(self):
+        self.id = get_jwt_identity()
+        self.project_ids = None
+        claims = get_jwt_claims()
+        if 'projects' in claims:
+            self.project_ids = set(claims['projects'])
+        self._profile = None
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            self._profile = models.User.query.get(self.id)
+        return self._profile
+
+def get_current_user():
+    if 'current_user' not in g:
+        g.current_user = CurrentUser()
+    return g.current_user
+
 def get_profile():
-    return models.User.query.get(get_jwt_identity())
+    return get_current_user().profile
 
-def authorize_project(project):
-    if not models.db.session.query(models.project_members)\
-             .filter_by(project_id=project.id,
-                        user_id=get_jwt_identity())\
-             .first():
+def membership_keys(user_id, project_ids):
+    """Returns membership cache keys, or {} when the versions are
+    unavailable, in which case memberships are read from the database."""
+    try:
+        return models.membership_cache.keys(user_id, project_ids)
+    except Exception:
+        app.logger.exception('Cannot read membership versions')
+        return {}
+
+def authorize_project(project_id):
+    current_user = get_current_user()
+    if current_user.project_ids is not None:
+        if project_id not in current_user.project_ids:
+            raise AccessDenied()
+        return
+    key = membership_keys(current_user.id, [project_id]).get(project_id)
+    is_member = None if key is None else models.membership_cache.get(key)
+    if is_member is None:
+        is_member = membership_query(current_user.id, project_id)\
+            .first() is not None
+        if key is not None:
+            models.membership_cache.set(key, is_member)
+    if not is_member:
         raise AccessDenied()
 
+def authorize_projects(project_ids):
+    current_user = get_current_user()
+    if current_user.project_ids is not None:
+        if not set(project_ids) <= current_user.project_ids:
+            raise AccessDenied()
+        return
+    keys = membership_keys(current_user.id, project_ids)
+    unknown = set(project_ids) - set(keys)
+    for project_id, key in keys.items():
+        is_member = models.membership_cache.get(key)
+        if is_member is None:
+            unknown.add(project_id)
+        elif not is_member:
+            raise AccessDenied()
+    if unknown:
+        member_of = {x for x, in models.db.session
+                     .query(models.project_members.c.project_id)
+                     .filter(models.project_members.c.user_id == current_user.id,
+                             models.project_members.c.project_id.in_(unknown))}
+        for project_id in unknown & set(keys):
+            models.membership_cache.set(keys[project_id],
+                                        project_id in member_of)
+        if unknown - member_of:
+            raise AccessDenied()
+
+def membership_query(user_id, project_id):
+    return models.db.session.query(models.project_members)\
+        .filter_by(project_id=project_id, user_id=user_id)
+
 def project_guard(fn):
     def wrapper(self, project_alias):
         project = models.Project.query.filter_by(alias=project_alias).first()
         if not project:
             raise NotFound()
-        authorize_project(project)
+        authorize_project(project.id)
         return fn(self, project)
     return wrapper
 
@@ -52,7 +145,7 @@ def sprint_guard(fn):
         sprint = models.Sprint.query.get(sprint_id)
         if not sprint:
             raise NotFound()
-        authorize_project(sprint.project)
+        authorize_project(sprint.project_id)
         return fn(self, sprint)
     return wrapper
 
@@ -61,19 +154,398 @@ def task_guard(fn):
         task = models.Task.query.get(task_id)
         if not task:
             raise NotFound()
-        authorize_project(task.project)
+        authorize_project(task.project_id)
         return fn(self, task)
     return wrapper
 
 def comment_guard(fn):
     def wrapper(self, comment_id):
-        comment = models.Task.query.get(comment_id)
-        if not comment:
+        row = models.db.session.query(models.Comment, models.Task.project_id)\
+            .join(models.Task, models.Comment.task_id == models.Task.id)\
+            .filter(models.Comment.id == comment_id)\
+            .first()
+        if not row:
             raise NotFound()
-        authorize_project(comment.task.project)
+        comment, project_id = row
+        authorize_project(project_id)
         return fn(self, comment)
     return wrapper
 
+def make_etag(*parts):
+    parts = (request.full_path, get_current_user().id,
+             datetime.now().date().isoformat()) + parts
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def not_modified(etag):
+    if etag not in request.if_none_match:
+        g.etag = etag
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+def conditional(get_version):
+    def decorator(fn):
+        def wrapper(self, target):
+            response = not_modified(make_etag(get_version(target)))
+            if response:
+                return response
+            return fn(self, target)
+        return wrapper
+    return decorator
+
+def cached(get_scope):
+    def decorator(fn):
+        def wrapper(self, target):
+            if response_cache is None:
+                return fn(self, target)
+            scope = get_scope(target)
+            response = response_cache.get(scope, g.etag)
+            if response is None:
+                response = fn(self, target)
+                if isinstance(response, dict):
+                    response_cache.set(scope, g.etag, response)
+            return response
+        return wrapper
+    return decorator
+
+def invalidate_cache(project_id):
+    if response_cache is not None:
+        response_cache.invalidate(project_id)
+
+@app.after_request
+def add_etag(response):
+    if 'etag' in g and response.status_code == 200:
+        response.set_etag(g.etag)
+    return response
+
+def get_project_version(project_id):
+    return models.db.session.query(models.Project.version)\
+        .filter_by(id=project_id)\
+        .scalar()
+
+def member_projects_query(user_id):
+    return models.Project.query\
+        .join(models.project_members,
+              models.project_members.c.project_id == models.Project.id)\
+        .filter(models.project_members.c.user_id == user_id)
+
+def current_sprints_query(project_ids, today):
+    return models.db.session.query(models.Sprint.project_id, models.Sprint.id)\
+        .filter(models.Sprint.project_id.in_(project_ids),
+                models.Sprint.start_date <= today,
+                models.Sprint.end_date >= today)\
+        .order_by(models.Sprint.start_date.desc())
+
+def get_current_sprints(projects):
+    if not projects:
+        return {}
+    rows = current_sprints_query([x.id for x in projects],
+                                 datetime.now().date()).all()
+    current_sprints = {}
+    for project_id, sprint_id in rows:
+        current_sprints.setdefault(project_id, sprint_id)
+    return current_sprints
+
+def sprint_number_query(sprint):
+    numbers = models.db.session\
+        .query(models.Sprint.id.label('id'), SPRINT_NUMBER.label('number'))\
+        .filter(models.Sprint.project_id == sprint.project_id)\
+        .subquery()
+    return models.db.session.query(numbers.c.number)\
+        .filter(numbers.c.id == sprint.id)
+
+def get_sprint_number(sprint):
+    return sprint_number_query(sprint).scalar()
+
+def completions_query(sprint_ids):
+    completion_day = models.db.func.date(models.Task.completion_date,
+                                         type_=models.db.Date)
+    return models.db.session.query(models.Task.sprint_id,
+                                   completion_day,
+                                   models.db.func.count(models.Task.id))\
+        .filter(models.Task.sprint_id.in_(sprint_ids))\
+        .group_by(models.Task.sprint_id, completion_day)
+
+def make_burndowns(sprints):
+    completions = defaultdict(dict)
+    task_counts = defaultdict(int)
+    if sprints:
+        rows = completions_query([x.id for x in sprints]).all()
+        for sprint_id, day, count in rows:
+            task_counts[sprint_id] += count
+            if day:
+                completions[sprint_id][day] = count
+
+    burndowns = {}
+    for sprint in sprints:
+        task_count = task_counts[sprint.id]
+        completed_by_day = completions[sprint.id]
+        completed_count = sum(count for day, count in completed_by_day.items()
+                              if day < sprint.start_date)
+        day_count = (sprint.end_date - sprint.start_date).days
+        burndown = []
+        for day_no in range(day_count):
+            d = sprint.start_date + timedelta(days=day_no)
+            actually_left = task_count - completed_count
+            should_be_left = int(task_count - (task_count * (day_no / day_count)))
+            burndown.append({
+                'date': d.isoformat(),
+                'actually_left': actually_left,
+                'should_be_left': should_be_left
+            })
+            completed_count += completed_by_day.get(d, 0)
+        burndowns[sprint.id] = burndown
+    return burndowns
+
+def encode_cursor(values):
+    values = [x.strftime(CURSOR_DATETIME_FORMAT) if isinstance(x, datetime)
+              else x for x in values]
+    return urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor_value(key, value):
+    if isinstance(key.type, models.db.DateTime):
+        return datetime.strptime(value, CURSOR_DATETIME_FORMAT)
+    if isinstance(key.type, models.db.Float):
+        return float(value)
+    return int(value)
+
+def decode_cursor(cursor, keys):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+        if len(values) != len(keys):
+            raise ValueError()
+        return [decode_cursor_value(key, v)
+                for (key, _), v in zip(keys, values)]
+    except (ValueError, TypeError):
+        abort(400, message='Invalid cursor')
+
+class Page:
+    def __init__(self, rows, limit, key_values, stream):
+        self.rows = rows
+        self.limit = limit
+        self.key_values = key_values
+        self.stream = stream
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        for i, row in enumerate(self.rows):
+            if self.limit is not None and i == self.limit:
+                self.next_cursor = encode_cursor(self.key_values(last))
+                break
+            last = row
+            yield row
+
+def keyset(query, keys, values=None):
+    query = query.order_by(*[key.desc() if descending else key
+                             for key, descending in keys])
+    if values is None:
+        return query
+    clauses = []
+    for i, (key, descending) in enumerate(keys):
+        clauses.append(models.db.and_(
+            *[k == v for (k, _), v in zip(keys[:i], values[:i])],
+            key < values[i] if descending else key > values[i]))
+    return query.filter(models.db.or_(*clauses))
+
+def paginate(query, keys, key_values):
+    parser = reqparse.RequestParser()
+    parser.add_argument('limit', type=int, location='args')
+    parser.add_argument('cursor', type=str, location='args')
+    parser.add_argument('stream', type=inputs.boolean, default=False,
+                        location='args')
+    args = parser.parse_args()
+
+    values = None
+    if args['cursor']:
+        values = decode_cursor(args['cursor'], keys)
+    query = keyset(query, keys, values)
+    limit = args['limit']
+    if limit is not None:
+        if limit < 1:
+            abort(400, message='limit: expected a positive integer')
+        limit = min(limit, app.config['MAX_PAGE_SIZE'])
+        query = query.limit(limit + 1)
+
+    if args['stream']:
+        rows = query.yield_per(app.config['STREAM_BATCH_SIZE'])
+    else:
+        rows = query.all()
+    return Page(rows, limit, key_values, args['stream'])
+
+def page_response(key, items, page):
+    if not page.stream:
+        items = list(items)
+        return schemas.without_nulls({key: items,
+                                      'nextCursor': page.next_cursor})
+
+    def generate():
+        yield '{%s: [' % json.dumps(key)
+        for i, item in enumerate(items):
+            yield (',' if i else '') + json.dumps(item)
+        if page.next_cursor:
+            yield '], "nextCursor": %s}' % json.dumps(page.next_cursor)
+        else:
+            yield ']}'
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
+
+def assigned_tasks_query(user_id, task_ids):
+    return models.db.session.query(models.task_assigments.c.task_id)\
+        .filter(models.task_assigments.c.user_id == user_id,
+                models.task_assigments.c.task_id.in_(task_ids))
+
+def parse_bulk_task(item):
+    if not isinstance(item, dict):
+        raise ValueError('Expected a task object')
+    task = {}
+    if not isinstance(item.get('title'), str):
+        raise ValueError('title: expected a string')
+    task['title'] = item['title']
+    try:
+        task['kind'] = models.TaskKind[item.get('kind')]
+    except (KeyError, TypeError):
+        raise ValueError('kind: expected one of ' +
+                         ', '.join(x.name for x in models.TaskKind))
+    for key, expected, default in [('sprint', int, None),
+                                   ('parentTask', int, None),
+                                   ('priority', int, 0),
+                                   ('initialEstimate', int, None),
+                                   ('acceptanceCriteria', str, None),
+                                   ('userStory', str, None)]:
+        value = item.get(key, default)
+        if (value is not None and (not isinstance(value, expected)
+                                   or isinstance(value, bool))):
+            raise ValueError('{}: expected {}'.format(key, expected.__name__))
+        task[key] = value
+    assignees = item.get('assignees', [])
+    if (not isinstance(assignees, list)
+            or not all(isinstance(x, str) for x in assignees)):
+        raise ValueError('assignees: expected a list of usernames')
+    task['assignees'] = list(dict.fromkeys(assignees))
+    return task
+
+def parse_task_change(item):
+    if not isinstance(item, dict):
+        raise ValueError('Expected a task object')
+    if not isinstance(item.get('id'), int) or isinstance(item['id'], bool):
+        raise ValueError('id: expected an integer')
+    change = {'id': item['id']}
+    if 'status' in item:
+        try:
+            change['status'] = models.TaskStatus[item['status']]
+        except (KeyError, TypeError):
+            raise ValueError('status: expected one of ' +
+                             ', '.join(x.name for x in models.TaskStatus))
+    for key in ('sprint', 'priority'):
+        if key in item:
+            value = item[key]
+            if (value is not None and (not isinstance(value, int)
+                                       or isinstance(value, bool))):
+                raise ValueError('{}: expected an integer'.format(key))
+            change[key] = value
+    if 'assignees' in item:
+        assignees = item['assignees']
+        if (not isinstance(assignees, list)
+                or not all(isinstance(x, str) for x in assignees)):
+            raise ValueError('assignees: expected a list of usernames')
+        change['assignees'] = list(dict.fromkeys(assignees))
+    return change
+
+def date_or_datetime(value):
+    """Parses YYYY-MM-DD as midnight, or a full ISO 8601 date and time."""
+    try:
+        return inputs.date(value)
+    except ValueError:
+        pass
+    try:
+        return inputs.datetime_from_iso8601(value)
+    except ValueError:
+        raise ValueError('expected YYYY-MM-DD or an ISO 8601 date and time')
+
+def enum_value(enum):
+    def convert(value):
+        try:
+            return enum[value]
+        except KeyError:
+            raise ValueError('expected one of ' +
+                             ', '.join(x.name for x in enum))
+    return convert
+
+def filter_tasks(query):
+    """Applies the task list filters given in the query string.
+
+    Repeating status, kind or assignee matches any of the values.
+    """
+    parser = reqparse.RequestParser()
+    parser.add_argument('status', type=enum_value(models.TaskStatus),
+                        action='append', location='args')
+    parser.add_argument('kind', type=enum_value(models.TaskKind),
+                        action='append', location='args')
+    parser.add_argument('assignee', type=str, action='append',
+                        location='args')
+    parser.add_argument('minPriority', type=int, location='args')
+    parser.add_argument('maxPriority', type=int, location='args')
+    parser.add_argument('createdAfter', type=date_or_datetime,
+                        location='args')
+    parser.add_argument('createdBefore', type=date_or_datetime,
+                        location='args')
+    parser.add_argument('completedAfter', type=date_or_datetime,
+                        location='args')
+    parser.add_argument('completedBefore', type=date_or_datetime,
+                        location='args')
+    parser.add_argument('sort', choices=list(TASK_SORTS), default='priority',
+                        location='args')
+    args = parser.parse_args()
+
+    priority = models.db.func.coalesce(models.Task.priority, 0)
+    if args['status']:
+        query = query.filter(models.Task.status.in_(args['status']))
+    if args['kind']:
+        query = query.filter(models.Task.kind.in_(args['kind']))
+    if args['assignee']:
+        assignee_ids = models.db.session.query(models.User.id)\
+            .filter(models.User.username.in_(args['assignee']))
+        query = query.filter(models.db.exists().where(models.db.and_(
+            models.task_assigments.c.task_id == models.Task.id,
+            models.task_assigments.c.user_id.in_(assignee_ids.subquery()))))
+    if args['minPriority'] is not None:
+        query = query.filter(priority >= args['minPriority'])
+    if args['maxPriority'] is not None:
+        query = query.filter(priority <= args['maxPriority'])
+    if args['createdAfter']:
+        query = query.filter(models.Task.creation_date >= args['createdAfter'])
+    if args['createdBefore']:
+        query = query.filter(models.Task.creation_date < args['createdBefore'])
+    if args['completedAfter']:
+        query = query.filter(
+            models.Task.completion_date >= args['completedAfter'])
+    if args['completedBefore']:
+        query = query.filter(
+            models.Task.completion_date < args['completedBefore'])
+    return query, TASK_SORTS[args['sort']]
+
+def dump_tasks(query):
+    query, (keys, key_values) = filter_tasks(query)
+    page = paginate(query.options(joinedload(models.Task.author)),
+                    keys, key_values)
+    # Streams are not loaded up front, so match their tasks in the database
+    if page.stream:
+        task_ids = query.with_entities(models.Task.id)
+    else:
+        task_ids = [x.id for x in page.rows]
+    assigned_ids = set()
+    if page.stream or task_ids:
+        assigned_ids = {x for x, in assigned_tasks_query(
+            get_current_user().id, task_ids)}
+
+    def dump(task):
+        t = schemas.Task.dump_short(task)
+        t['assignedToMe'] = task.id in assigned_ids
+        return t
+    return page_response('tasks', (dump(x) for x in page), page)
+
 class Login(Resource):
     def post(self):
         parser = reqparse.RequestParser()
@@ -83,9 +555,21 @@ class Login(Resource):
         user = models.User.query.filter_by(username=args['username']).first()
         if not user:
             return {'message': 'No such user'}, 401
-        if not user.verify_password(args['password']):
+        try:
+            valid = user.verify_password(args['password'])
+        except passwords.HashingBusy:
+            return {'message': 'Too many logins in progress'}, 503
+        if not valid:
             return {'message': 'Invalid password'}, 401
-        access_token = create_access_token(identity=user.id)
+        if user in models.db.session.dirty:
+            models.db.session.commit()
+        user_claims = {}
+        if app.config['JWT_MEMBERSHIP_CLAIMS']:
+            user_claims['projects'] = [x for x, in models.db.session\
+                .query(models.project_members.c.project_id)\
+                .filter(models.project_members.c.user_id == user.id)]
+        access_token = create_access_token(identity=user.id,
+                                           user_claims=user_claims)
         return {'access_token': access_token}
 
 class Profile(Resource):
@@ -112,26 +596,44 @@ class Profile(Resource):
 class Projects(Resource):
     @jwt_required
     def get(self):
-        profile = get_profile()
-        return {'projects': [schemas.Project.dump(x) for x in profile.projects]}
+        projects = member_projects_query(get_current_user().id).all()
+        response = not_modified(make_etag([(x.id, x.version)
+                                           for x in projects]))
+        if response:
+            return response
+        current_sprints = get_current_sprints(projects)
+        return {'projects': [schemas.Project.dump(x, current_sprints.get(x.id))
+                             for x in projects]}
 
 class Project(Resource):
     @jwt_required
     @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
     def get(self, project):
-        return schemas.Project.dump(project)
+        current_sprints = get_current_sprints([project])
+        return schemas.Project.dump(project, current_sprints.get(project.id))
 
 class ProjectMembers(Resource):
     @jwt_required
     @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
     def get(self, project):
         return {'members': [schemas.User.dump(x) for x in project.members]}
 
 class ProjectSprints(Resource):
     @jwt_required
     @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
     def get(self, project):
-        return {'sprints': [schemas.Sprint.dump(x) for x in project.sprints]}
+        sprints = models.db.session.query(models.Sprint, SPRINT_NUMBER)\
+            .filter(models.Sprint.project_id == project.id)\
+            .order_by(models.Sprint.start_date, models.Sprint.id)\
+            .all()
+        return {'sprints': [schemas.Sprint.dump(x, number)
+                            for x, number in sprints]}
 
     @jwt_required
     @project_guard
@@ -141,14 +643,11 @@ class ProjectSprints(Resource):
 class ProjectTasks(Resource):
     @jwt_required
     @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
     def get(self, project):
-        profile = get_profile()
-        tasks_out = []
-        for task in project.tasks:
-            t = schemas.Task.dump_short(task)
-            t['assignedToMe'] = profile in task.assignees
-            tasks_out.append(t)
-        return {'tasks': tasks_out}
+        query = models.Task.query.filter_by(project_id=project.id)
+        return dump_tasks(query)
 
     @jwt_required
     @project_guard
@@ -173,12 +672,186 @@ class ProjectTasks(Resource):
 
         models.db.session.add(task)
         models.db.session.commit()
+        invalidate_cache(project.id)
+
+class ProjectTasksBulk(Resource):
+    @jwt_required
+    @project_guard
+    def post(self, project):
+        items = request.get_json(silent=True)
+        if not isinstance(items, list) or not items:
+            return {'message': 'Expected a list of tasks'}, 400
+        if len(items) > app.config['MAX_BULK_SIZE']:
+            return {'message': 'Too many tasks'}, 400
+
+        try:
+            tasks = [parse_bulk_task(x) for x in items]
+        except ValueError as e:
+            return {'message': str(e)}, 400
+
+        usernames = {x for task in tasks for x in task['assignees']}
+        sprint_ids = {x['sprint'] for x in tasks if x['sprint'] is not None}
+        parent_ids = {x['parentTask'] for x in tasks
+                      if x['parentTask'] is not None}
+        users = {}
+        if usernames:
+            users = dict(models.db.session
+                         .query(models.User.username, models.User.id)
+                         .filter(models.User.username.in_(usernames)))
+        sprints = set()
+        if sprint_ids:
+            sprints = {x for x, in models.db.session
+                       .query(models.Sprint.id)
+                       .filter(models.Sprint.id.in_(sprint_ids),
+                               models.Sprint.project_id == project.id)}
+        parents = set()
+        if parent_ids:
+            parents = {x for x, in models.db.session
+                       .query(models.Task.id)
+                       .filter(models.Task.id.in_(parent_ids),
+                               models.Task.project_id == project.id)}
+        if usernames - set(users):
+            return {'message': 'No such user: ' +
+                    ', '.join(sorted(usernames - set(users)))}, 400
+        if sprint_ids - sprints:
+            return {'message': 'No such sprint: ' +
+                    ', '.join(map(str, sorted(sprint_ids - sprints)))}, 400
+        if parent_ids - parents:
+            return {'message': 'No such task: ' +
+                    ', '.join(map(str, sorted(parent_ids - parents)))}, 400
+
+        now = datetime.now()
+        author_id = get_current_user().id
+        rows = [{
+            'project_id': project.id,
+            'sprint_id': x['sprint'],
+            'parent_task_id': x['parentTask'],
+            'author_id': author_id,
+            'title': x['title'],
+            'creation_date': now,
+            'status': models.TaskStatus.BACKLOG,
+            'kind': x['kind'],
+            'priority': x['priority'],
+            'acceptance_criteria': x['acceptanceCriteria'],
+            'user_story': x['userStory'],
+            'initial_estimate': x['initialEstimate'],
+            'version': 0
+        } for x in tasks]
+        ids = models.bulk_insert(models.db.session, models.Task.__table__,
+                                 rows, returning=True)
+        assignments = [{'task_id': task_id, 'user_id': users[username]}
+                       for task_id, task in zip(ids, tasks)
+                       for username in task['assignees']]
+        models.bulk_insert(models.db.session, models.task_assigments,
+                           assignments)
+        models.bump_versions(models.db.session, project_ids=[project.id])
+        models.db.session.commit()
+        invalidate_cache(project.id)
+
+        return {'ids': ids}
+
+class ProjectBurndown(Resource):
+    @jwt_required
+    @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
+    def get(self, project):
+        parser = reqparse.RequestParser()
+        parser.add_argument('sprint', type=int, action='append',
+                            location='args')
+        args = parser.parse_args()
+
+        query = models.Sprint.query\
+            .filter_by(project_id=project.id)\
+            .order_by(models.Sprint.start_date)
+        if args['sprint']:
+            query = query.filter(models.Sprint.id.in_(args['sprint']))
+        sprints = query.all()
+
+        burndowns = make_burndowns(sprints)
+        return {'burndowns': [{'sprint': x.id, 'burndown': burndowns[x.id]}
+                              for x in sprints]}
+
+class ProjectAnalytics(Resource):
+    @jwt_required
+    @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
+    def get(self, project):
+        sprints = models.db.session.query(models.Sprint, SPRINT_NUMBER)\
+            .filter(models.Sprint.project_id == project.id)\
+            .order_by(models.Sprint.start_date, models.Sprint.id)\
+            .all()
+        rows = analytics.task_columns_query(
+            models.Task.project_id == project.id).all()
+        by_sprint = analytics.group_by_sprint(rows)
+
+        today = datetime.now().date()
+        sprint_stats = []
+        velocity = []
+        for sprint, number in sprints:
+            stats = analytics.summarize(by_sprint[sprint.id])
+            if sprint.end_date < today:
+                velocity.append(stats['completedEffort'])
+            stats.update(schemas.Sprint.dump(sprint, number))
+            sprint_stats.append(schemas.without_nulls(stats))
+        return schemas.without_nulls({
+            'sprints': sprint_stats,
+            'backlog': schemas.without_nulls(
+                analytics.summarize(by_sprint[None])),
+            'total': schemas.without_nulls(analytics.summarize(rows)),
+            'velocity': analytics.distribution(velocity)
+        })
+
+class ProjectSearch(Resource):
+    @jwt_required
+    @project_guard
+    @conditional(lambda x: x.version)
+    @cached(lambda x: x.id)
+    def get(self, project):
+        parser = reqparse.RequestParser()
+        parser.add_argument('q', type=str, required=True, location='args')
+        args = parser.parse_args()
+        if not re.search(r'\w', args['q']):
+            return {'message': 'Expected search terms'}, 400
+
+        matches = models.search_query(project.id, args['q'])
+        page = paginate(models.db.session.query(matches),
+                        [(matches.c.rank, True), (matches.c.kind, False),
+                         (matches.c.id, False)],
+                        lambda x: (x.rank, x.kind, x.id))
+        rows = list(page)
+
+        task_ids = {x.task_id for x in rows}
+        comment_ids = {x.id for x in rows if x.kind == 1}
+        tasks = {}
+        if task_ids:
+            tasks = {x.id: x for x in models.Task.query
+                     .filter(models.Task.id.in_(task_ids))
+                     .options(joinedload(models.Task.author))}
+        comments = {}
+        if comment_ids:
+            comments = {x.id: x for x in models.Comment.query
+                        .filter(models.Comment.id.in_(comment_ids))
+                        .options(joinedload(models.Comment.author))}
+
+        def dump(row):
+            result = {
+                'rank': row.rank,
+                'task': schemas.Task.dump_short(tasks[row.task_id])
+            }
+            if row.kind == 1:
+                result['comment'] = schemas.Comment.dump(comments[row.id])
+            return result
+        return page_response('results', (dump(x) for x in rows), page)
 
 class Sprint(Resource):
     @jwt_required
     @sprint_guard
+    @conditional(lambda x: get_project_version(x.project_id))
+    @cached(lambda x: x.project_id)
     def get(self, sprint):
-        return schemas.Sprint.dump(sprint)
+        return schemas.Sprint.dump(sprint, get_sprint_number(sprint))
 
     @jwt_required
     @sprint_guard
@@ -188,42 +861,44 @@ class Sprint(Resource):
     @jwt_required
     @sprint_guard
     def delete(self, sprint):
+        project_id = sprint.project_id
         models.db.session.delete(sprint)
         models.db.session.commit()
+        invalidate_cache(project_id)
 
 class SprintTasks(Resource):
     @jwt_required
     @sprint_guard
+    @conditional(lambda x: get_project_version(x.project_id))
+    @cached(lambda x: x.project_id)
+    def get(self, sprint):
+        query = models.Task.query.filter_by(sprint_id=sprint.id)
+        return dump_tasks(query)
+
+class SprintStats(Resource):
+    @jwt_required
+    @sprint_guard
+    @conditional(lambda x: get_project_version(x.project_id))
+    @cached(lambda x: x.project_id)
     def get(self, sprint):
-        return {'tasks': [schemas.Task.dump_short(x) for x in sprint.tasks]}
+        rows = analytics.task_columns_query(
+            models.Task.sprint_id == sprint.id).all()
+        stats = analytics.summarize(rows)
+        stats.update(schemas.Sprint.dump(sprint, get_sprint_number(sprint)))
+        return schemas.without_nulls(stats)
 
 class SprintBurndown(Resource):
     @jwt_required
     @sprint_guard
+    @conditional(lambda x: get_project_version(x.project_id))
+    @cached(lambda x: x.project_id)
     def get(self, sprint):
-        task_count = models.Task.query\
-            .filter_by(sprint_id=sprint.id)\
-            .count()
-        day_count = (sprint.end_date - sprint.start_date).days
-        burndown = []
-        for day_no in range(day_count):
-            d = sprint.start_date + timedelta(days=day_no)
-            completed_count = models.Task.query\
-                .filter(models.Task.sprint_id == sprint.id,
-                        models.Task.completion_date <= d)\
-                .count()
-            actually_left = task_count - completed_count
-            should_be_left = int(task_count - (task_count * (day_no / day_count)))
-            burndown.append({
-                'date': d.isoformat(),
-                'actually_left': actually_left,
-                'should_be_left': should_be_left
-            })
-        return {'burndown': burndown}
+        return {'burndown': make_burndowns([sprint])[sprint.id]}
 
 class Task(Resource):
     @jwt_required
     @task_guard
+    @conditional(lambda x: x.version)
     def get(self, task):
         d = schemas.Task.dump_full(task)
         d['assignees'] = [schemas.User.dump(x) for x in task.assignees]
@@ -249,24 +924,130 @@ class Task(Resource):
 
         if (task.status != models.TaskStatus.DONE
                 and args.get('status') == 'DONE'):
-            tasks.completion_date = datetime.now()
+            task.completion_date = datetime.now()
 
         schemas.Task.load(task, args)
 
+        project_id = task.project_id
         models.db.session.add(task)
         models.db.session.commit()
+        invalidate_cache(project_id)
 
     @jwt_required
     @task_guard
     def delete(self, task):
+        project_id = task.project_id
         models.db.session.delete(task)
         models.db.session.commit()
+        invalidate_cache(project_id)
+
+class Tasks(Resource):
+    @jwt_required
+    def patch(self):
+        items = request.get_json(silent=True)
+        if not isinstance(items, list) or not items:
+            return {'message': 'Expected a list of task changes'}, 400
+        if len(items) > app.config['MAX_BULK_SIZE']:
+            return {'message': 'Too many tasks'}, 400
+        try:
+            changes = [parse_task_change(x) for x in items]
+        except ValueError as e:
+            return {'message': str(e)}, 400
+
+        task_ids = {x['id'] for x in changes}
+        if len(task_ids) < len(changes):
+            return {'message': 'Each task may only be changed once'}, 400
+        task_projects = dict(models.db.session
+                             .query(models.Task.id, models.Task.project_id)
+                             .filter(models.Task.id.in_(task_ids)))
+        if task_ids - set(task_projects):
+            raise NotFound()
+        authorize_projects(set(task_projects.values()))
+
+        sprint_ids = {x['sprint'] for x in changes
+                      if x.get('sprint') is not None}
+        sprint_projects = {}
+        if sprint_ids:
+            sprint_projects = dict(models.db.session
+                                   .query(models.Sprint.id,
+                                          models.Sprint.project_id)
+                                   .filter(models.Sprint.id.in_(sprint_ids)))
+        for change in changes:
+            sprint_id = change.get('sprint')
+            if (sprint_id is not None and sprint_projects.get(sprint_id)
+                    != task_projects[change['id']]):
+                return {'message': 'No such sprint: {}'.format(sprint_id)}, 400
+
+        usernames = {x for change in changes
+                     for x in change.get('assignees', [])}
+        users = {}
+        if usernames:
+            users = dict(models.db.session
+                         .query(models.User.username, models.User.id)
+                         .filter(models.User.username.in_(usernames)))
+        if usernames - set(users):
+            return {'message': 'No such user: ' +
+                    ', '.join(sorted(usernames - set(users)))}, 400
+
+        # Tasks receiving the same values are updated with one statement
+        groups = defaultdict(list)
+        for change in changes:
+            values = tuple(sorted((k, v) for k, v in change.items()
+                                  if k in ('status', 'sprint', 'priority')))
+            if values:
+                groups[values].append(change['id'])
+
+        tasks = models.Task.__table__
+        now = datetime.now()
+        for values, ids in groups.items():
+            values = dict(values)
+            update = {}
+            if 'status' in values:
+                update['status'] = values['status']
+                if values['status'] == models.TaskStatus.DONE:
+                    update['completion_date'] = models.db.case(
+                        [(models.db.or_(tasks.c.status == None,
+                                        tasks.c.status != models.TaskStatus.DONE),
+                          now)],
+                        else_=tasks.c.completion_date)
+            if 'sprint' in values:
+                update['sprint_id'] = values['sprint']
+            if 'priority' in values:
+                update['priority'] = values['priority']
+            models.db.session.execute(tasks.update()
+                                      .where(tasks.c.id.in_(ids))
+                                      .values(**update))
+
+        reassigned = [x for x in changes if 'assignees' in x]
+        if reassigned:
+            models.db.session.execute(models.task_assigments.delete().where(
+                models.task_assigments.c.task_id.in_(
+                    [x['id'] for x in reassigned])))
+            models.bulk_insert(models.db.session, models.task_assigments,
+                               [{'task_id': x['id'], 'user_id': users[y]}
+                                for x in reassigned for y in x['assignees']])
+
+        project_ids = set(task_projects.values())
+        models.bump_versions(models.db.session, project_ids, task_ids)
+        models.db.session.commit()
+        for project_id in project_ids:
+            invalidate_cache(project_id)
+
+        return {'ok': True}
 
 class TaskComments(Resource):
     @jwt_required
     @task_guard
+    @conditional(lambda x: x.version)
     def get(self, task):
-        return {'comments': [schemas.Comment.dump(x) for x in task.comments]}
+        query = models.Comment.query\
+            .filter_by(task_id=task.id)\
+            .options(joinedload(models.Comment.author))
+        page = paginate(query, COMMENT_ORDER,
+                        lambda x: (x.creation_date or models.COMMENT_EPOCH,
+                                   x.id))
+        return page_response('comments',
+                             (schemas.Comment.dump(x) for x in page), page)
 
     @jwt_required
     @task_guard
@@ -277,21 +1058,31 @@ class TaskComments(Resource):
 
         comment = models.Comment()
         comment.task = task
-        comment.author = get_profile()
+        comment.author_id = get_current_user().id
         comment.creation_date = datetime.now()
         comment.message = args['message']
 
+        project_id = task.project_id
         models.db.session.add(comment)
         models.db.session.commit()
+        invalidate_cache(project_id)
 
         return {'id': comment.id}
 
 class Comment(Resource):
     @jwt_required
     @comment_guard
+    @conditional(lambda x: x.task.version)
     def get(self, comment):
         return schemas.Comment.dump(comment)
 
+class CacheStats(Resource):
+    @jwt_required
+    def get(self):
+        if response_cache is None:
+            return {}
+        return response_cache.stats()
+
 api.add_resource(Login, '/login')
 api.add_resource(Profile, '/profile')
 api.add_resource(Projects, '/projects')
@@ -299,9 +1090,19 @@ api.add_resource(Project, '/projects/<string:project_alias>')
 api.add_resource(ProjectMembers, '/projects/<string:project_alias>/members')
 api.add_resource(ProjectSprints, '/projects/<string:project_alias>/sprints')
 api.add_resource(ProjectTasks, '/projects/<string:project_alias>/tasks')
+api.add_resource(ProjectTasksBulk,
+                 '/projects/<string:project_alias>/tasks/bulk')
+api.add_resource(ProjectBurndown,
+                 '/projects/<string:project_alias>/burndown')
+api.add_resource(ProjectAnalytics,
+                 '/projects/<string:project_alias>/analytics')
+api.add_resource(ProjectSearch, '/projects/<string:project_alias>/search')
 api.add_resource(Sprint, '/sprints/<int:sprint_id>')
 api.add_resource(SprintTasks, '/sprints/<int:sprint_id>/tasks')
+api.add_resource(SprintStats, '/sprints/<int:sprint_id>/stats')
 api.add_resource(SprintBurndown, '/sprints/<int:sprint_id>/burndown')
+api.add_resource(Tasks, '/tasks')
 api.add_resource(Task, '/tasks/<int:task_id>')
 api.add_resource(TaskComments, '/tasks/<int:task_id>/comments')
 api.add_resource(Comment, '/comments/<int:comment_id>')
+api.add_resource(CacheStats, '/cache')
@@ -1,5 +1,3 @@
-from datetime import datetime
-
 from server import models
 
 def without_nulls(d):
@@ -25,13 +23,7 @@ class User:
 
 class Project:
     @classmethod
-    def dump(cls, project):
-        today = datetime.now().date()
-        current_sprint = models.Sprint.query\
-            .filter(models.Sprint.project_id == project.id,
-                    models.Sprint.start_date <= today,
-                    models.Sprint.end_date >= today)\
-            .first()
+    def dump(cls, project, current_sprint_id):
         return without_nulls({
             'alias': project.alias,
             'name': project.name,
@@ -39,15 +31,15 @@ class Project:
             'vcsLink': project.vcs_link,
             'btsLink': project.bts_link,
             'cisLink': project.cis_link,
-            'currentSprint': (current_sprint.id if current_sprint else None)
+            'currentSprint': current_sprint_id
         })
 
 class Sprint:
     @classmethod
-    def dump(cls, sprint):
+    def dump(cls, sprint, number):
         return without_nulls({
             'id': sprint.id,
-            'number': sprint.project.sprints.index(sprint) + 1,
+            'number': number,
             'startDate': sprint.start_date.isoformat(),
             'endDate': sprint.end_date.isoformat(),
             'goal': sprint.goal
@@ -136,7 +128,8 @@ class Comment:
             'id': comment.id,
             'task': comment.task.id,
             'author': comment.author.username,
-            'creationDate': comment.creation_date.isoformat(),
+            'creationDate': (comment.creation_date.isoformat()
+                             if comment.creation_date else None),
             'message': comment.message
         })
 